@@ -1,11 +1,43 @@
+import asyncio
+import gzip
 import json
 import os
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from azure.core.pipeline.transport import RequestsTransport
 from azure.cosmos import CosmosClient, exceptions
 from azure.storage.blob import BlobServiceClient
+from requests import Session
+from requests.adapters import HTTPAdapter
 import logging
 
+# orjson parses blob payloads several times faster than the stdlib when it is installed
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+# aiohttp and the aio SDK clients are only needed by AsyncTieredRetrieval
+try:
+    import aiohttp
+    from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+    from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+except ImportError:
+    aiohttp = None
+
+# Redis is only needed when REDIS_URL is set
+try:
+    import redis
+    import redis.asyncio
+except ImportError:
+    redis = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -13,163 +45,468 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# A customer's documents, whole: Tier 1 records need no second read, and migrated
+# records carry their blob pointer fields
+CUSTOMER_RECORDS_QUERY = """
+SELECT TOP @limit *
+FROM c
+WHERE c.customerId = @customer_id
+ORDER BY c.createdAt DESC
+"""
+
+# Customer records are fetched in pages of this size so blob downloads can start
+# before the whole result has arrived
+CUSTOMER_QUERY_PAGE_SIZE = int(os.getenv('CUSTOMER_QUERY_PAGE_SIZE', '100'))
+
+# Most recently written records, used to warm the in-process caches
+WARM_CACHE_QUERY = """
+SELECT TOP @top_k VALUE c.id
+FROM c
+WHERE c.id != 'tier-counters'
+ORDER BY c._ts DESC
+"""
+
+# Per-tier record counts, refreshed by the migration job after every run so that
+# statistics are a single point read instead of a cross-partition aggregation. The
+# migration job stores the id as the document's partition key value too
+TIER_COUNTERS_ID = 'tier-counters'
+TIER_COUNTS_QUERY = """
+SELECT c.storage_tier, COUNT(1) as record_count
+FROM c
+WHERE c.id != 'tier-counters'
+GROUP BY c.storage_tier
+"""
+STATS_CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '60'))
+# The counters document is only rewritten when a migration finishes; when it is older
+# than this (seconds), statistics are aggregated live instead
+TIER_COUNTERS_MAX_AGE = float(os.getenv('TIER_COUNTERS_MAX_AGE', str(24 * 60 * 60)))
+
+# Human readable names for each retrieval source
+TIER_NAMES = {
+    'tier1-cosmos': 'Tier 1 (Cosmos DB)',
+    'tier2-hot': 'Tier 2 (Hot Blob)',
+    'tier3-cold': 'Tier 3 (Cold Blob)'
+}
+
+# Connection tuning shared by all clients. The Python Cosmos SDK only speaks
+# Gateway (HTTPS) mode, so the pool size and timeout are the knobs available
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '32'))
+COSMOS_REQUEST_TIMEOUT = int(os.getenv('COSMOS_REQUEST_TIMEOUT', '5'))
+# Optional Cosmos DB dedicated gateway: reads sent through it are answered from the
+# integrated cache, at no RU cost, when a copy younger than the staleness bound exists
+COSMOS_DEDICATED_GATEWAY_ENDPOINT = os.getenv('COSMOS_DEDICATED_GATEWAY_ENDPOINT')
+INTEGRATED_CACHE_STALENESS_MS = int(os.getenv('INTEGRATED_CACHE_STALENESS_MS', '30000'))
+INTEGRATED_CACHE_OPTIONS = (
+    {'max_integrated_cache_staleness_in_ms': INTEGRATED_CACHE_STALENESS_MS}
+    if COSMOS_DEDICATED_GATEWAY_ENDPOINT else {}
+)
+# Retrieval is read-only, so Session (or Eventual) consistency is enough; both are
+# cheaper than Strong/Bounded Staleness and are required by the integrated cache
+COSMOS_CONSISTENCY_LEVEL = os.getenv('COSMOS_CONSISTENCY_LEVEL', 'Session')
+BLOB_URL_POOL_SIZE = int(os.getenv('BLOB_URL_POOL_SIZE', '200'))
+# Parallel range requests per blob download; only kicks in for blobs larger than
+# the SDK's single-request size
+BLOB_DOWNLOAD_CONCURRENCY = int(os.getenv('BLOB_DOWNLOAD_CONCURRENCY', '4'))
+# Optional Redis-protocol cache (Azure Cache for Redis, Garnet) shared by every
+# retrieval process, checked before any storage tier
+REDIS_URL = os.getenv('REDIS_URL')
+REDIS_RECORD_TTL = int(os.getenv('REDIS_RECORD_TTL', '300'))
+
+def _parse_blob(data):
+    """Parse a record blob, inflating it first if it was stored gzip-compressed"""
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return _json_loads(data)
+
+def _require_aiohttp():
+    """Raise a clear error when the async API is used without aiohttp installed"""
+    if aiohttp is None:
+        raise ImportError("AsyncTieredRetrieval requires aiohttp: pip install aiohttp")
+
+def _elapsed_ms(start_ns):
+    """Milliseconds elapsed since a time.perf_counter_ns() reading"""
+    return (time.perf_counter_ns() - start_ns) / 1_000_000
+
+def _pooled_transport(pool_size=HTTP_POOL_SIZE):
+    """
+    Build a requests transport whose connection pool can serve pool_size concurrent calls
+    (urllib3 keeps only 10 connections per host by default, fewer than our thread pools use)
+    """
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return RequestsTransport(session=session, session_owner=True)
+
+class _LRUCache:
+    """Small thread-safe LRU mapping with a fixed maximum size and optional TTL (seconds)"""
+    
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            expires_at, value = self._data[key]
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+    
+    def put(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+    
+    def __len__(self):
+        return len(self._data)
+
 class TieredRetrieval:
     def __init__(self):
         """Initialize connections to all storage tiers"""
         # Cosmos DB configuration (Tier 1)
         self.cosmos_client = CosmosClient(
-            url=os.getenv('COSMOS_ENDPOINT'),
-            credential=os.getenv('COSMOS_KEY')
+            url=COSMOS_DEDICATED_GATEWAY_ENDPOINT or os.getenv('COSMOS_ENDPOINT'),
+            credential=os.getenv('COSMOS_KEY'),
+            consistency_level=COSMOS_CONSISTENCY_LEVEL,
+            connection_timeout=COSMOS_REQUEST_TIMEOUT,
+            transport=_pooled_transport()
         )
         self.database = self.cosmos_client.get_database_client(os.getenv('COSMOS_DATABASE', 'billing-database'))
         self.container = self.database.get_container_client('billing-records')
         
         # Blob Storage configuration (Tier 2 & 3)
         self.blob_client = BlobServiceClient.from_connection_string(
-            os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+            os.getenv('AZURE_STORAGE_CONNECTION_STRING'),
+            transport=_pooled_transport()
         )
         self.hot_container = 'billing-hot'
         self.cold_container = 'billing-cold'
+        self._hot_container_client = self.blob_client.get_container_client(self.hot_container)
+        self._cold_container_client = self.blob_client.get_container_client(self.cold_container)
+        
+        # Shared record cache (optional)
+        self._redis = redis.Redis.from_url(REDIS_URL) if redis and REDIS_URL else None
+        
+        # In-process caches and performance tracking
+        self._init_local_state()
+    
+    def _init_local_state(self):
+        """Set up in-process caches and performance counters"""
+        # record_id -> (storage_tier, blob_path, blob_url) for migrated records, so repeat
+        # lookups can go straight to blob storage without a Cosmos DB read
+        self._metadata_cache = _LRUCache(int(os.getenv('METADATA_CACHE_SIZE', '100000')))
+        
+        # record_id -> full record from any tier, so repeat reads are served from memory
+        self._record_cache = _LRUCache(
+            int(os.getenv('RECORD_CACHE_SIZE', '50000')),
+            ttl=float(os.getenv('RECORD_CACHE_TTL', '300'))
+        )
         
         # Performance tracking
-        self.performance_stats = {
+        self.performance_stats = self._new_performance_stats()
+        self._stats_lock = threading.Lock()
+        
+        # Background cache warming, see start_cache_warmer()
+        self._cache_warmer = None
+        
+        # (expires_at, tier counts) from the last get_storage_statistics() call
+        self._stats_cache = None
+    
+    @staticmethod
+    def _new_performance_stats():
+        """Create empty performance tracking counters"""
+        return {
             'tier1_hits': 0,
             'tier2_hits': 0,
             'tier3_hits': 0,
+            'cache_hits': 0,
             'cache_misses': 0,
-            'average_response_times': {
-                'tier1': [],
-                'tier2': [],
-                'tier3': []
+            # Running totals keep memory constant however many requests are served;
+            # kept in integer nanoseconds and converted to ms when reported
+            'response_times': {
+                'tier1': {'count': 0, 'total_ns': 0},
+                'tier2': {'count': 0, 'total_ns': 0},
+                'tier3': {'count': 0, 'total_ns': 0}
             }
         }
     
-    def get_billing_record(self, record_id):
+    def _count(self, counter, tier=None, elapsed_ns=None):
+        """Increment a performance counter and, for tier hits, its response time totals"""
+        with self._stats_lock:
+            self.performance_stats[counter] += 1
+            if tier:
+                totals = self.performance_stats['response_times'][tier]
+                totals['count'] += 1
+                totals['total_ns'] += elapsed_ns
+    
+    def get_billing_record(self, record_id, hint_tier=None, hint_blob_path=None):
         """
         Smart retrieval that searches all tiers automatically
+        Pass hint_tier/hint_blob_path when the blob location of a migrated record is
+        already known to skip the Cosmos DB lookup
         Returns: (record_data, source_tier, response_time_ms)
         """
-        start_time = time.time()
+        start_time = time.perf_counter_ns()
+        
+        logger.debug("Searching for record %s across all storage tiers", record_id)
+        
+        # Recently retrieved records are served from memory
+        cached = self._get_cached_record(record_id, start_time)
+        if cached:
+            return cached
         
-        logger.info(f"🔍 Searching for record {record_id} across all storage tiers")
+        # Then from the shared Redis cache, if configured
+        cached = self._get_shared_record(record_id, start_time)
+        if cached:
+            return cached
+        
+        result = self._search_tiers(record_id, hint_tier, hint_blob_path, start_time)
+        if result[0] is not None:
+            self._put_shared_record(record_id, result[0])
+        return result
+    
+    def _search_tiers(self, record_id, hint_tier, hint_blob_path, start_time):
+        """
+        Look a record up in Cosmos DB and the blob tiers, bypassing the caches
+        Returns: (record_data, source_tier, response_time_ms)
+        """
+        # Known blob location (caller hint or cached metadata): skip Cosmos DB entirely
+        location = self._known_location(record_id, hint_tier, hint_blob_path)
+        if location:
+            blob_record, source = self._search_blob_tier(*location)
+            if blob_record:
+                self._metadata_cache.put(record_id, location)
+                return self._record_found(record_id, blob_record, source, start_time)
+            
+            # Stale location (e.g. record moved to cold storage since), ask Cosmos DB
+            self._metadata_cache.pop(record_id)
         
         # Tier 1: Search Cosmos DB first (fastest - 1-10ms)
-        logger.debug(f"Searching Tier 1 (Cosmos DB) for record {record_id}")
+        logger.debug("Searching Tier 1 (Cosmos DB) for record %s", record_id)
         record, tier1_time = self._search_cosmos_db(record_id)
         
         if record and self._is_record_in_tier1(record):
             # Record found in Tier 1 and hasn't been migrated
-            response_time = (time.time() - start_time) * 1000
-            self.performance_stats['tier1_hits'] += 1
-            self.performance_stats['average_response_times']['tier1'].append(response_time)
-            
-            logger.info(f"✅ Found record {record_id} in Tier 1 (Cosmos DB) - {response_time:.2f}ms")
-            return record, 'tier1-cosmos', response_time
-        
-        # Tier 2: Search Hot Blob Storage (medium speed - 100-500ms)
-        if record and record.get('storage_tier') == 'hot_blob':
-            logger.debug(f"Searching Tier 2 (Hot Blob) for record {record_id}")
-            blob_record, tier2_time = self._search_hot_blob(record.get('blob_path'))
-            
-            if blob_record:
-                response_time = (time.time() - start_time) * 1000
-                self.performance_stats['tier2_hits'] += 1
-                self.performance_stats['average_response_times']['tier2'].append(response_time)
-                
-                logger.info(f"✅ Found record {record_id} in Tier 2 (Hot Blob) - {response_time:.2f}ms")
-                return blob_record, 'tier2-hot', response_time
+            return self._record_found(record_id, record, 'tier1-cosmos', start_time)
         
-        # Tier 3: Search Cold Blob Storage (slower - 1-3 seconds)
-        if record and record.get('storage_tier') == 'cold_blob':
-            logger.debug(f"Searching Tier 3 (Cold Blob) for record {record_id}")
-            blob_record, tier3_time = self._search_cold_blob(record.get('blob_path'))
+        # Tier 2 / Tier 3: Follow the blob pointer kept in Cosmos DB
+        if record:
+            location = self._blob_location(record)
+            blob_record, source = self._search_blob_tier(*location)
             
             if blob_record:
-                response_time = (time.time() - start_time) * 1000
-                self.performance_stats['tier3_hits'] += 1
-                self.performance_stats['average_response_times']['tier3'].append(response_time)
-                
-                logger.info(f"✅ Found record {record_id} in Tier 3 (Cold Blob) - {response_time:.2f}ms")
-                return blob_record, 'tier3-cold', response_time
+                self._metadata_cache.put(record_id, location)
+                return self._record_found(record_id, blob_record, source, start_time)
         
         # Not found in any tier
-        response_time = (time.time() - start_time) * 1000
-        self.performance_stats['cache_misses'] += 1
+        return self._record_not_found(record_id, start_time)
+    
+    def _get_cached_record(self, record_id, start_time):
+        """Return (record_data, 'cache', response_time_ms) for a cached record, else None"""
+        record = self._record_cache.get(record_id)
+        if record is None:
+            return None
+        
+        response_time = _elapsed_ms(start_time)
+        self._count('cache_hits')
+        
+        logger.debug("Served record %s from the in-process cache", record_id)
+        return record, 'cache', response_time
+    
+    def _get_shared_record(self, record_id, start_time):
+        """Return (record_data, 'redis', response_time_ms) for a record held in Redis, else None"""
+        if self._redis is None:
+            return None
+        
+        try:
+            raw = self._redis.get(f'record:{record_id}')
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Redis lookup failed for record {record_id}: {e}")
+            return None
+        return self._shared_record_hit(record_id, raw, start_time)
+    
+    def _shared_record_hit(self, record_id, raw, start_time):
+        """Decode a Redis value and keep the record in memory for later reads"""
+        if raw is None:
+            return None
+        
+        try:
+            record = _json_loads(raw)
+        except ValueError as e:
+            # A truncated or foreign value is a miss; the tiered lookup that follows
+            # overwrites it with the record it finds
+            logger.warning(f"⚠️ Ignoring unreadable Redis entry for record {record_id}: {e}")
+            return None
+        self._record_cache.put(record_id, record)
         
-        logger.warning(f"❌ Record {record_id} not found in any storage tier - {response_time:.2f}ms")
+        response_time = _elapsed_ms(start_time)
+        self._count('cache_hits')
+        
+        logger.debug("Served record %s from Redis", record_id)
+        return record, 'redis', response_time
+    
+    def _put_shared_record(self, record_id, record):
+        """Store a record in Redis for REDIS_RECORD_TTL seconds"""
+        if self._redis is None:
+            return
+        
+        try:
+            self._redis.setex(f'record:{record_id}', REDIS_RECORD_TTL, _json_dumps(record))
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Could not cache record {record_id} in Redis: {e}")
+    
+    def invalidate(self, record_id):
+        """Drop a record from the caches, e.g. after it has been updated or migrated"""
+        self._record_cache.pop(record_id)
+        self._metadata_cache.pop(record_id)
+        if self._redis is None:
+            return
+        
+        try:
+            self._redis.delete(f'record:{record_id}')
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Could not remove record {record_id} from Redis: {e}")
+    
+    def _known_location(self, record_id, hint_tier=None, hint_blob_path=None):
+        """Return the blob location of a record if it is already known, else None"""
+        if hint_tier in ('hot_blob', 'cold_blob') and hint_blob_path:
+            return hint_tier, hint_blob_path, None, None, None
+        return self._metadata_cache.get(record_id)
+    
+    @staticmethod
+    def _blob_location(item):
+        """
+        Blob pointer fields of a Cosmos DB metadata document:
+        (storage_tier, blob_path, blob_url, blob_offset, blob_length)
+        blob_offset/blob_length locate a record inside a bundle blob
+        """
+        return (
+            item.get('storage_tier'), item.get('blob_path'), item.get('blob_url'),
+            item.get('blob_offset'), item.get('blob_length')
+        )
+    
+    def _search_blob_tier(self, storage_tier, blob_path, blob_url=None, blob_offset=None, blob_length=None):
+        """
+        Fetch a record from the blob tier named by its Cosmos DB metadata
+        (blob_url is only used by AsyncTieredRetrieval)
+        Returns: (record_data, source_tier)
+        """
+        if storage_tier == 'hot_blob':
+            # Tier 2: Hot Blob Storage (medium speed - 100-500ms)
+            record, _ = self._search_hot_blob(blob_path, blob_offset, blob_length)
+            return record, 'tier2-hot'
+        if storage_tier == 'cold_blob':
+            # Tier 3: Cold Blob Storage (slower - 1-3 seconds)
+            record, _ = self._search_cold_blob(blob_path, blob_offset, blob_length)
+            return record, 'tier3-cold'
+        return None, None
+    
+    def _record_not_found(self, record_id, start_time):
+        """Update miss statistics for a record that is not in any tier"""
+        response_time = _elapsed_ms(start_time)
+        self._count('cache_misses')
+        
+        logger.debug("Record %s not found in any storage tier - %.2fms", record_id, response_time)
         return None, 'not-found', response_time
     
+    def _record_found(self, record_id, record, source, start_time):
+        """Update hit statistics for a successful lookup"""
+        elapsed_ns = time.perf_counter_ns() - start_time
+        response_time = elapsed_ns / 1_000_000
+        tier = source.split('-')[0]
+        self._count(f'{tier}_hits', tier, elapsed_ns)
+        self._record_cache.put(record_id, record)
+        
+        logger.debug("Found record %s in %s - %.2fms", record_id, TIER_NAMES[source], response_time)
+        return record, source, response_time
+    
     def _search_cosmos_db(self, record_id):
         """Search for record in Cosmos DB (Tier 1)"""
-        search_start = time.time()
+        search_start = time.perf_counter_ns()
         
         try:
-            logger.debug(f"Querying Cosmos DB for record {record_id}")
-            item = self.container.read_item(item=record_id, partition_key=record_id)
-            search_time = (time.time() - search_start) * 1000
+            logger.debug("Querying Cosmos DB for record %s", record_id)
+            item = self.container.read_item(
+                item=record_id, partition_key=record_id, **INTEGRATED_CACHE_OPTIONS
+            )
+            search_time = _elapsed_ms(search_start)
             
-            logger.debug(f"Cosmos DB query completed in {search_time:.2f}ms")
+            logger.debug("Cosmos DB query completed in %.2fms", search_time)
             return item, search_time
             
         except exceptions.CosmosResourceNotFoundError:
-            search_time = (time.time() - search_start) * 1000
-            logger.debug(f"Record {record_id} not found in Cosmos DB ({search_time:.2f}ms)")
+            search_time = _elapsed_ms(search_start)
+            logger.debug("Record %s not found in Cosmos DB (%.2fms)", record_id, search_time)
             return None, search_time
             
         except Exception as e:
-            search_time = (time.time() - search_start) * 1000
+            search_time = _elapsed_ms(search_start)
             logger.error(f"Error searching Cosmos DB for {record_id}: {e} ({search_time:.2f}ms)")
             return None, search_time
     
-    def _search_hot_blob(self, blob_path):
-        """Search for record in Hot Blob Storage (Tier 2)"""
+    def _search_hot_blob(self, blob_path, offset=None, length=None):
+        """
+        Search for record in Hot Blob Storage (Tier 2)
+        offset/length read a single record out of a bundle blob
+        """
         if not blob_path:
             return None, 0
             
-        search_start = time.time()
+        search_start = time.perf_counter_ns()
         
         try:
-            logger.debug(f"Retrieving from Hot Blob Storage: {blob_path}")
-            blob_client = self.blob_client.get_blob_client(
-                container=self.hot_container,
-                blob=blob_path
-            )
-            
-            blob_data = blob_client.download_blob().readall()
-            record = json.loads(blob_data.decode('utf-8'))
-            search_time = (time.time() - search_start) * 1000
+            logger.debug("Retrieving from Hot Blob Storage: %s", blob_path)
+            blob_data = self._hot_container_client.download_blob(
+                blob_path, offset=offset, length=length, max_concurrency=BLOB_DOWNLOAD_CONCURRENCY
+            ).readall()
+            record = _parse_blob(blob_data)
+            search_time = _elapsed_ms(search_start)
             
-            logger.debug(f"Hot blob retrieval completed in {search_time:.2f}ms")
+            logger.debug("Hot blob retrieval completed in %.2fms", search_time)
             return record, search_time
             
         except Exception as e:
-            search_time = (time.time() - search_start) * 1000
+            search_time = _elapsed_ms(search_start)
             logger.error(f"Error retrieving from hot blob {blob_path}: {e} ({search_time:.2f}ms)")
             return None, search_time
     
-    def _search_cold_blob(self, blob_path):
-        """Search for record in Cold Blob Storage (Tier 3)"""
+    def _search_cold_blob(self, blob_path, offset=None, length=None):
+        """
+        Search for record in Cold Blob Storage (Tier 3)
+        offset/length read a single record out of a bundle blob
+        """
         if not blob_path:
             return None, 0
             
-        search_start = time.time()
+        search_start = time.perf_counter_ns()
         
         try:
-            logger.debug(f"Retrieving from Cold Blob Storage: {blob_path}")
-            blob_client = self.blob_client.get_blob_client(
-                container=self.cold_container,
-                blob=blob_path
-            )
-            
-            blob_data = blob_client.download_blob().readall()
-            record = json.loads(blob_data.decode('utf-8'))
-            search_time = (time.time() - search_start) * 1000
+            logger.debug("Retrieving from Cold Blob Storage: %s", blob_path)
+            blob_data = self._cold_container_client.download_blob(
+                blob_path, offset=offset, length=length, max_concurrency=BLOB_DOWNLOAD_CONCURRENCY
+            ).readall()
+            record = _parse_blob(blob_data)
+            search_time = _elapsed_ms(search_start)
             
-            logger.debug(f"Cold blob retrieval completed in {search_time:.2f}ms")
+            logger.debug("Cold blob retrieval completed in %.2fms", search_time)
             return record, search_time
             
         except Exception as e:
-            search_time = (time.time() - search_start) * 1000
+            search_time = _elapsed_ms(search_start)
             logger.error(f"Error retrieving from cold blob {blob_path}: {e} ({search_time:.2f}ms)")
             return None, search_time
     
@@ -178,77 +515,223 @@ class TieredRetrieval:
         storage_tier = record.get('storage_tier')
         return storage_tier is None or storage_tier == 'cosmos'
     
-    def get_multiple_records(self, record_ids):
+    def get_multiple_records(self, record_ids, max_workers=16, chunk_size=100):
         """
         Retrieve multiple records efficiently
+        Cosmos DB metadata is read with one query per chunk of IDs instead of one
+        point read per ID, and blob downloads run concurrently on a thread pool
         Returns: list of (record_id, record_data, source_tier, response_time)
         """
         logger.info(f"🔍 Retrieving {len(record_ids)} records from tiered storage")
-        results = []
+        if not record_ids:
+            return []
+        
+        start_time = time.perf_counter_ns()
+        results_by_id = {}
+        pending_ids = []
         
+        for record_id in dict.fromkeys(record_ids):
+            cached = self._get_cached_record(record_id, start_time)
+            if cached:
+                results_by_id[record_id] = cached
+            else:
+                pending_ids.append(record_id)
+        
+        items = self._read_items_by_ids(pending_ids, chunk_size)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            
+            for record_id in pending_ids:
+                item = items.get(record_id)
+                if item is None:
+                    # Not returned by the bulk query, fall back to a regular lookup
+                    futures[executor.submit(self.get_billing_record, record_id)] = record_id
+                elif self._is_record_in_tier1(item):
+                    results_by_id[record_id] = self._record_found(record_id, item, 'tier1-cosmos', start_time)
+                else:
+                    futures[executor.submit(self._fetch_migrated_record, record_id, item, start_time)] = record_id
+            
+            for future in as_completed(futures):
+                results_by_id[futures[future]] = future.result()
+        
+        # Emit results in the same order as the requested IDs
+        results = []
         for record_id in record_ids:
-            record, source, response_time = self.get_billing_record(record_id)
+            record, source, response_time = results_by_id[record_id]
             results.append((record_id, record, source, response_time))
         
         return results
     
-    def get_records_by_customer(self, customer_id, limit=100):
+    def _read_items_by_ids(self, record_ids, chunk_size=100):
+        """
+        Read Cosmos DB documents for many IDs with one query per chunk
+        Returns: dict of record_id -> item for the documents that were found
+        """
+        items = {}
+        query = "SELECT * FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+        
+        for offset in range(0, len(record_ids), chunk_size):
+            chunk = record_ids[offset:offset + chunk_size]
+            try:
+                for item in self.container.query_items(
+                    query=query,
+                    parameters=[{"name": "@ids", "value": chunk}],
+                    enable_cross_partition_query=True,
+                    **INTEGRATED_CACHE_OPTIONS
+                ):
+                    items[item['id']] = item
+            except Exception as e:
+                logger.error(f"Error reading {len(chunk)} records from Cosmos DB: {e}")
+        
+        return items
+    
+    def _fetch_migrated_record(self, record_id, item, start_time):
+        """Download a migrated record using the blob pointer from its Cosmos DB metadata"""
+        location = self._blob_location(item)
+        record, source = self._search_blob_tier(*location)
+        
+        if record:
+            self._metadata_cache.put(record_id, location)
+            return self._record_found(record_id, record, source, start_time)
+        
+        return self._record_not_found(record_id, start_time)
+    
+    def warm_cache(self, top_k=10000, max_workers=16):
+        """
+        Prefetch the most recently written records into the in-process caches
+        Warming does not count towards the hit/miss statistics
+        Returns: number of records cached
+        """
+        logger.info(f"🔥 Warming cache with up to {top_k} recent records")
+        
+        try:
+            record_ids = list(self.container.query_items(
+                query=WARM_CACHE_QUERY,
+                parameters=[{"name": "@top_k", "value": top_k}],
+                enable_cross_partition_query=True
+            ))
+        except Exception as e:
+            logger.error(f"Error querying recent records for cache warming: {e}")
+            return 0
+        
+        items = self._read_items_by_ids(record_ids)
+        warmed = 0
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            
+            for record_id, item in items.items():
+                if self._is_record_in_tier1(item):
+                    self._record_cache.put(record_id, item)
+                    warmed += 1
+                else:
+                    location = self._blob_location(item)
+                    futures[executor.submit(self._search_blob_tier, *location)] = (record_id, location)
+            
+            for future in as_completed(futures):
+                record_id, location = futures[future]
+                record, _ = future.result()
+                if record:
+                    self._metadata_cache.put(record_id, location)
+                    self._record_cache.put(record_id, record)
+                    warmed += 1
+        
+        logger.info(f"Cache warmed with {warmed} records")
+        return warmed
+    
+    def start_cache_warmer(self, top_k=10000, interval_seconds=300):
+        """Warm the cache now and then every interval_seconds on a daemon thread"""
+        if self._cache_warmer is not None:
+            return
+        
+        stop_event = threading.Event()
+        
+        def run():
+            while not stop_event.is_set():
+                self.warm_cache(top_k)
+                stop_event.wait(interval_seconds)
+        
+        thread = threading.Thread(target=run, name='tiered-cache-warmer', daemon=True)
+        self._cache_warmer = stop_event
+        thread.start()
+    
+    def stop_cache_warmer(self):
+        """Stop the background cache warmer started by start_cache_warmer()"""
+        if self._cache_warmer is not None:
+            self._cache_warmer.set()
+            self._cache_warmer = None
+    
+    def get_records_by_customer(self, customer_id, limit=100, max_workers=32):
         """
         Get records for a specific customer across all tiers
+        Blob-backed records are downloaded concurrently on a thread pool
         Returns: list of records sorted by creation date (newest first)
         """
         logger.info(f"🔍 Searching for records by customer {customer_id}")
         
-        all_records = []
-        
         try:
-            # Query Cosmos DB for all records (including migrated ones for metadata)
-            query = "SELECT * FROM c WHERE c.customerId = @customer_id ORDER BY c.createdAt DESC"
-            parameters = [{"name": "@customer_id", "value": customer_id}]
+            # Query Cosmos DB for the customer's documents (including migrated ones); the
+            # ORDER BY is served by the (customerId, createdAt) composite index
+            query = CUSTOMER_RECORDS_QUERY
+            parameters = [
+                {"name": "@customer_id", "value": customer_id},
+                {"name": "@limit", "value": limit}
+            ]
             
-            items = list(self.container.query_items(
+            pages = self.container.query_items(
                 query=query,
                 parameters=parameters,
                 enable_cross_partition_query=True,
-                max_item_count=limit
-            ))
+                max_item_count=min(limit, CUSTOMER_QUERY_PAGE_SIZE),
+                **INTEGRATED_CACHE_OPTIONS
+            ).by_page()
             
-            logger.info(f"Found {len(items)} records for customer {customer_id}")
+            # (item, future) in Cosmos DB order: Tier 1 items are the records themselves
+            # (future None), blob-backed items get a download each
+            pending = []
             
-            # For each record, get the full data from appropriate tier
-            for item in items:
-                if self._is_record_in_tier1(item):
-                    # Record is in Tier 1 (Cosmos DB)
-                    all_records.append({
-                        'record': item,
-                        'source': 'tier1-cosmos',
-                        'record_id': item['id']
-                    })
-                elif item.get('storage_tier') == 'hot_blob':
-                    # Record is in Tier 2 (Hot Blob)
-                    blob_record, _ = self._search_hot_blob(item.get('blob_path'))
-                    if blob_record:
-                        all_records.append({
-                            'record': blob_record,
-                            'source': 'tier2-hot',
-                            'record_id': item['id']
-                        })
-                elif item.get('storage_tier') == 'cold_blob':
-                    # Record is in Tier 3 (Cold Blob)
-                    blob_record, _ = self._search_cold_blob(item.get('blob_path'))
-                    if blob_record:
-                        all_records.append({
-                            'record': blob_record,
-                            'source': 'tier3-cold',
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # Each page's downloads start as soon as it arrives, so they overlap
+                # with fetching the next page
+                for page in pages:
+                    for item in page:
+                        if self._is_record_in_tier1(item):
+                            pending.append((item, None))
+                        else:
+                            pending.append((item, executor.submit(self._resolve_customer_record, item)))
+                
+                logger.info(f"Found {len(pending)} records for customer {customer_id}")
+                
+                results = []
+                for item, future in pending:
+                    if future is None:
+                        record, source = item, 'tier1-cosmos'
+                    else:
+                        record, source = future.result()
+                    
+                    if record:
+                        results.append({
+                            'record': record,
+                            'source': source,
                             'record_id': item['id']
                         })
             
-            return all_records
+            return results
             
         except Exception as e:
             logger.error(f"Error retrieving records for customer {customer_id}: {e}")
             return []
     
+    def _resolve_customer_record(self, item):
+        """Fetch the full record for a migrated Cosmos DB item from its blob tier"""
+        # Record is in Tier 2 (Hot Blob) or Tier 3 (Cold Blob)
+        location = self._blob_location(item)
+        record, source = self._search_blob_tier(*location)
+        if record:
+            self._metadata_cache.put(item['id'], location)
+        return record, source
+    
     def get_storage_statistics(self):
         """
         Get statistics about data distribution across storage tiers
@@ -260,44 +743,83 @@ class TieredRetrieval:
             'tier2_hot_blob': 0,
             'tier3_cold_blob': 0,
             'total_records': 0,
+            # When the tier counts were computed (UTC, ISO 8601)
+            'tier_counts_updated_at': None,
             'performance': self._get_performance_stats()
         }
         
         try:
-            # Query record counts by storage tier
-            query = """
-            SELECT 
-                c.storage_tier,
-                COUNT(1) as record_count
-            FROM c 
-            GROUP BY c.storage_tier
-            """
-            
-            items = list(self.container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
-            
-            for item in items:
-                tier = item.get('storage_tier', 'cosmos')
-                count = item.get('record_count', 0)
-                
-                if tier in [None, 'cosmos']:
-                    stats['tier1_cosmos'] = count
-                elif tier == 'hot_blob':
-                    stats['tier2_hot_blob'] = count
-                elif tier == 'cold_blob':
-                    stats['tier3_cold_blob'] = count
-                
-                stats['total_records'] += count
-            
-            logger.info(f"Storage statistics gathered: {stats}")
+            stats.update(self._get_tier_counts())
+            logger.debug("Storage statistics gathered: %s", stats)
             return stats
             
         except Exception as e:
             logger.error(f"Error getting storage statistics: {e}")
             return stats
     
+    def _get_tier_counts(self):
+        """
+        Record counts per storage tier, read from the counters document kept by the
+        migration job, or aggregated across partitions if it does not exist yet or
+        is older than TIER_COUNTERS_MAX_AGE
+        """
+        cached = self._recent_tier_counts()
+        if cached:
+            return cached
+        
+        try:
+            counters = self.container.read_item(item=TIER_COUNTERS_ID, partition_key=TIER_COUNTERS_ID)
+        except exceptions.CosmosResourceNotFoundError:
+            counters = None
+        
+        if self._counters_are_fresh(counters):
+            return self._cache_tier_counts(counters.get('tiers', {}), counters['updatedAt'])
+        
+        by_tier = self._fold_tier_groups(self.container.query_items(
+            query=TIER_COUNTS_QUERY,
+            enable_cross_partition_query=True,
+            **INTEGRATED_CACHE_OPTIONS
+        ))
+        return self._cache_tier_counts(by_tier, datetime.utcnow().isoformat())
+    
+    @staticmethod
+    def _counters_are_fresh(counters):
+        """True if the counters document was updated within TIER_COUNTERS_MAX_AGE"""
+        try:
+            updated_at = datetime.fromisoformat(counters['updatedAt'])
+        except (TypeError, KeyError, ValueError):
+            return False
+        return (datetime.utcnow() - updated_at).total_seconds() <= TIER_COUNTERS_MAX_AGE
+    
+    def _recent_tier_counts(self):
+        """Tier counts from the last STATS_CACHE_TTL seconds, else None"""
+        cached = self._stats_cache
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+    
+    def _cache_tier_counts(self, by_tier, updated_at):
+        """Convert {storage_tier: count} into statistics fields and cache them"""
+        counts = {
+            'tier1_cosmos': by_tier.get('cosmos', 0),
+            'tier2_hot_blob': by_tier.get('hot_blob', 0),
+            'tier3_cold_blob': by_tier.get('cold_blob', 0),
+            'total_records': sum(by_tier.values()),
+            'tier_counts_updated_at': updated_at
+        }
+        self._stats_cache = (time.monotonic() + STATS_CACHE_TTL, counts)
+        return counts
+    
+    @staticmethod
+    def _fold_tier_groups(groups):
+        """Sum GROUP BY storage_tier rows into {storage_tier: count}"""
+        by_tier = {}
+        for item in groups:
+            # Records never migrated have no storage_tier
+            tier = item.get('storage_tier') or 'cosmos'
+            by_tier[tier] = by_tier.get(tier, 0) + item.get('record_count', 0)
+        return by_tier
+    
     def _get_performance_stats(self):
         """Calculate performance statistics"""
         stats = {
@@ -305,9 +827,11 @@ class TieredRetrieval:
                 self.performance_stats['tier1_hits'],
                 self.performance_stats['tier2_hits'],
                 self.performance_stats['tier3_hits'],
+                self.performance_stats['cache_hits'],
                 self.performance_stats['cache_misses']
             ]),
             'hit_distribution': {
+                'cache_percentage': 0,
                 'tier1_percentage': 0,
                 'tier2_percentage': 0,
                 'tier3_percentage': 0,
@@ -318,28 +842,586 @@ class TieredRetrieval:
         
         total = stats['total_requests']
         if total > 0:
+            stats['hit_distribution']['cache_percentage'] = (self.performance_stats['cache_hits'] / total) * 100
             stats['hit_distribution']['tier1_percentage'] = (self.performance_stats['tier1_hits'] / total) * 100
             stats['hit_distribution']['tier2_percentage'] = (self.performance_stats['tier2_hits'] / total) * 100
             stats['hit_distribution']['tier3_percentage'] = (self.performance_stats['tier3_hits'] / total) * 100
             stats['hit_distribution']['miss_percentage'] = (self.performance_stats['cache_misses'] / total) * 100
         
         # Calculate average response times
-        for tier, times in self.performance_stats['average_response_times'].items():
-            if times:
-                stats['average_response_times'][tier] = sum(times) / len(times)
+        for tier, totals in self.performance_stats['response_times'].items():
+            if totals['count']:
+                stats['average_response_times'][tier] = totals['total_ns'] / totals['count'] / 1_000_000
             else:
                 stats['average_response_times'][tier] = 0
         
         return stats
 
+class AsyncTieredRetrieval(TieredRetrieval):
+    """
+    Asyncio variant of TieredRetrieval built on the aio SDK clients
+    Usage: async with AsyncTieredRetrieval() as retrieval:
+               record, source, response_time = await retrieval.get_billing_record("record-id-123")
+    """
+    
+    def __init__(self):
+        """Initialize async connections to all storage tiers"""
+        _require_aiohttp()
+        
+        # Cosmos DB configuration (Tier 1)
+        self.cosmos_client = AsyncCosmosClient(
+            url=COSMOS_DEDICATED_GATEWAY_ENDPOINT or os.getenv('COSMOS_ENDPOINT'),
+            credential=os.getenv('COSMOS_KEY'),
+            consistency_level=COSMOS_CONSISTENCY_LEVEL,
+            connection_timeout=COSMOS_REQUEST_TIMEOUT
+        )
+        self.database = self.cosmos_client.get_database_client(os.getenv('COSMOS_DATABASE', 'billing-database'))
+        self.container = self.database.get_container_client('billing-records')
+        
+        # Blob Storage configuration (Tier 2 & 3)
+        self.blob_client = AsyncBlobServiceClient.from_connection_string(
+            os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+        )
+        self.hot_container = 'billing-hot'
+        self.cold_container = 'billing-cold'
+        self._hot_container_client = self.blob_client.get_container_client(self.hot_container)
+        self._cold_container_client = self.blob_client.get_container_client(self.cold_container)
+        
+        # Shared record cache (optional)
+        self._redis = redis.asyncio.Redis.from_url(REDIS_URL) if redis and REDIS_URL else None
+        
+        # Shared HTTP session for pre-signed blob URLs, opened in __aenter__
+        self._http_session = None
+        
+        # In-process caches and performance tracking
+        self._init_local_state()
+    
+    async def __aenter__(self):
+        _require_aiohttp()
+        await self.cosmos_client.__aenter__()
+        await self.blob_client.__aenter__()
+        self._http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=BLOB_URL_POOL_SIZE)
+        )
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
+    async def close(self):
+        """Close the underlying Cosmos DB, Blob Storage and HTTP connections"""
+        self.stop_cache_warmer()
+        await self.cosmos_client.close()
+        await self.blob_client.close()
+        if self._redis is not None:
+            await self._redis.aclose()
+        if self._http_session is not None:
+            await self._http_session.close()
+            self._http_session = None
+    
+    async def get_billing_record(self, record_id, hint_tier=None, hint_blob_path=None):
+        """
+        Smart retrieval that searches all tiers automatically
+        Pass hint_tier/hint_blob_path when the blob location of a migrated record is
+        already known to skip the Cosmos DB lookup
+        Returns: (record_data, source_tier, response_time_ms)
+        """
+        start_time = time.perf_counter_ns()
+        
+        logger.debug("Searching for record %s across all storage tiers", record_id)
+        
+        # Recently retrieved records are served from memory
+        cached = self._get_cached_record(record_id, start_time)
+        if cached:
+            return cached
+        
+        # Then from the shared Redis cache, if configured
+        cached = await self._get_shared_record(record_id, start_time)
+        if cached:
+            return cached
+        
+        result = await self._search_tiers(record_id, hint_tier, hint_blob_path, start_time)
+        if result[0] is not None:
+            await self._put_shared_record(record_id, result[0])
+        return result
+    
+    async def _search_tiers(self, record_id, hint_tier, hint_blob_path, start_time):
+        """
+        Look a record up in Cosmos DB and the blob tiers, bypassing the caches
+        Returns: (record_data, source_tier, response_time_ms)
+        """
+        # Known blob location (caller hint or cached metadata): fetch the blob and probe
+        # Cosmos DB at the same time, so a stale location costs max(blob, Cosmos DB)
+        # instead of their sum
+        location = self._known_location(record_id, hint_tier, hint_blob_path)
+        if location:
+            blob_task = asyncio.create_task(self._search_blob_tier(*location))
+            cosmos_task = asyncio.create_task(self._search_cosmos_db(record_id))
+            done, _ = await asyncio.wait(
+                [blob_task, cosmos_task], return_when=asyncio.FIRST_COMPLETED
+            )
+            
+            if blob_task in done:
+                blob_record, source = blob_task.result()
+                if blob_record:
+                    cosmos_task.cancel()
+                    self._metadata_cache.put(record_id, location)
+                    return self._record_found(record_id, blob_record, source, start_time)
+                
+                self._metadata_cache.pop(record_id)
+                record, tier1_time = await cosmos_task
+            else:
+                record, tier1_time = cosmos_task.result()
+                confirmed = record and self._blob_location(record)
+                if confirmed and confirmed[:2] == location[:2] and confirmed[3:] == location[3:]:
+                    # Cosmos DB confirms the location, the blob fetch in flight is the answer
+                    blob_record, source = await blob_task
+                    if blob_record:
+                        self._metadata_cache.put(record_id, location)
+                        return self._record_found(record_id, blob_record, source, start_time)
+                    return self._record_not_found(record_id, start_time)
+                
+                blob_task.cancel()
+                self._metadata_cache.pop(record_id)
+        else:
+            # Tier 1: Search Cosmos DB first
+            record, tier1_time = await self._search_cosmos_db(record_id)
+        
+        if record and self._is_record_in_tier1(record):
+            return self._record_found(record_id, record, 'tier1-cosmos', start_time)
+        
+        # Tier 2 / Tier 3: Follow the blob pointer kept in Cosmos DB
+        if record:
+            location = self._blob_location(record)
+            blob_record, source = await self._search_blob_tier(*location)
+            
+            if blob_record:
+                self._metadata_cache.put(record_id, location)
+                return self._record_found(record_id, blob_record, source, start_time)
+        
+        # Not found in any tier
+        return self._record_not_found(record_id, start_time)
+    
+    async def _get_shared_record(self, record_id, start_time):
+        """Return (record_data, 'redis', response_time_ms) for a record held in Redis, else None"""
+        if self._redis is None:
+            return None
+        
+        try:
+            raw = await self._redis.get(f'record:{record_id}')
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Redis lookup failed for record {record_id}: {e}")
+            return None
+        return self._shared_record_hit(record_id, raw, start_time)
+    
+    async def _put_shared_record(self, record_id, record):
+        """Store a record in Redis for REDIS_RECORD_TTL seconds"""
+        if self._redis is None:
+            return
+        
+        try:
+            await self._redis.setex(f'record:{record_id}', REDIS_RECORD_TTL, _json_dumps(record))
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Could not cache record {record_id} in Redis: {e}")
+    
+    async def invalidate(self, record_id):
+        """Drop a record from the caches, e.g. after it has been updated or migrated"""
+        self._record_cache.pop(record_id)
+        self._metadata_cache.pop(record_id)
+        if self._redis is None:
+            return
+        
+        try:
+            await self._redis.delete(f'record:{record_id}')
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Could not remove record {record_id} from Redis: {e}")
+    
+    async def _search_blob_tier(self, storage_tier, blob_path, blob_url=None, blob_offset=None, blob_length=None):
+        """
+        Fetch a record from the blob tier named by its Cosmos DB metadata
+        A pre-signed blob_url is fetched directly over the shared HTTP session,
+        falling back to the Blob Storage client when it is missing or rejected
+        Returns: (record_data, source_tier)
+        """
+        if storage_tier == 'hot_blob':
+            source, search = 'tier2-hot', self._search_hot_blob
+        elif storage_tier == 'cold_blob':
+            source, search = 'tier3-cold', self._search_cold_blob
+        else:
+            return None, None
+        
+        if blob_url and self._http_session is not None:
+            record = await self._download_from_url(blob_url, blob_offset, blob_length)
+            if record is not None:
+                return record, source
+        
+        record, _ = await search(blob_path, blob_offset, blob_length)
+        return record, source
+    
+    async def _download_from_url(self, blob_url, offset=None, length=None):
+        """GET a record from a pre-signed blob URL; None if the URL is stale or expired"""
+        _require_aiohttp()
+        search_start = time.perf_counter_ns()
+        
+        # Records inside a bundle blob are fetched with a Range request
+        headers = {}
+        if offset is not None and length:
+            headers['Range'] = f"bytes={offset}-{offset + length - 1}"
+        
+        try:
+            async with self._http_session.get(blob_url, headers=headers) as response:
+                if response.status not in (200, 206):
+                    logger.debug("Blob URL returned HTTP %s, falling back to the blob client", response.status)
+                    return None
+                blob_data = await response.read()
+            
+            record = _parse_blob(blob_data)
+            search_time = _elapsed_ms(search_start)
+            
+            logger.debug("Direct blob URL retrieval completed in %.2fms", search_time)
+            return record
+            
+        except Exception as e:
+            logger.debug("Direct blob URL retrieval failed, falling back to the blob client: %s", e)
+            return None
+    
+    async def _search_cosmos_db(self, record_id):
+        """Search for record in Cosmos DB (Tier 1)"""
+        search_start = time.perf_counter_ns()
+        
+        try:
+            item = await self.container.read_item(
+                item=record_id, partition_key=record_id, **INTEGRATED_CACHE_OPTIONS
+            )
+            search_time = _elapsed_ms(search_start)
+            
+            logger.debug("Cosmos DB query completed in %.2fms", search_time)
+            return item, search_time
+            
+        except exceptions.CosmosResourceNotFoundError:
+            search_time = _elapsed_ms(search_start)
+            logger.debug("Record %s not found in Cosmos DB (%.2fms)", record_id, search_time)
+            return None, search_time
+            
+        except Exception as e:
+            search_time = _elapsed_ms(search_start)
+            logger.error(f"Error searching Cosmos DB for {record_id}: {e} ({search_time:.2f}ms)")
+            return None, search_time
+    
+    async def _search_hot_blob(self, blob_path, offset=None, length=None):
+        """Search for record in Hot Blob Storage (Tier 2)"""
+        return await self._search_blob(self._hot_container_client, blob_path, offset, length)
+    
+    async def _search_cold_blob(self, blob_path, offset=None, length=None):
+        """Search for record in Cold Blob Storage (Tier 3)"""
+        return await self._search_blob(self._cold_container_client, blob_path, offset, length)
+    
+    async def _search_blob(self, container_client, blob_path, offset=None, length=None):
+        """Download and parse a record (or one record of a bundle) from the given blob container"""
+        if not blob_path:
+            return None, 0
+        
+        search_start = time.perf_counter_ns()
+        
+        try:
+            downloader = await container_client.download_blob(
+                blob_path, offset=offset, length=length, max_concurrency=BLOB_DOWNLOAD_CONCURRENCY
+            )
+            blob_data = await downloader.readall()
+            record = _parse_blob(blob_data)
+            search_time = _elapsed_ms(search_start)
+            
+            logger.debug("Blob retrieval from %s completed in %.2fms", container_client.container_name, search_time)
+            return record, search_time
+            
+        except Exception as e:
+            search_time = _elapsed_ms(search_start)
+            logger.error(f"Error retrieving from {container_client.container_name} {blob_path}: {e} ({search_time:.2f}ms)")
+            return None, search_time
+    
+    async def get_multiple_records(self, record_ids, chunk_size=100):
+        """
+        Retrieve multiple records concurrently on the event loop
+        Cosmos DB metadata is read with one query per chunk of IDs
+        Returns: list of (record_id, record_data, source_tier, response_time)
+        """
+        logger.info(f"🔍 Retrieving {len(record_ids)} records from tiered storage")
+        if not record_ids:
+            return []
+        
+        start_time = time.perf_counter_ns()
+        results_by_id = {}
+        pending_ids = []
+        
+        for record_id in dict.fromkeys(record_ids):
+            cached = self._get_cached_record(record_id, start_time)
+            if cached:
+                results_by_id[record_id] = cached
+            else:
+                pending_ids.append(record_id)
+        
+        items = await self._read_items_by_ids(pending_ids, chunk_size)
+        
+        lookups = []
+        for record_id in pending_ids:
+            item = items.get(record_id)
+            if item is None:
+                lookups.append(self.get_billing_record(record_id))
+            else:
+                lookups.append(self._fetch_item_record(record_id, item, start_time))
+        
+        for record_id, result in zip(pending_ids, await asyncio.gather(*lookups)):
+            results_by_id[record_id] = result
+        
+        return [
+            (record_id, *results_by_id[record_id])
+            for record_id in record_ids
+        ]
+    
+    async def _read_items_by_ids(self, record_ids, chunk_size=100):
+        """
+        Read Cosmos DB documents for many IDs, one concurrent query per chunk
+        Returns: dict of record_id -> item for the documents that were found
+        """
+        query = "SELECT * FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+        
+        async def read_chunk(chunk):
+            try:
+                return [
+                    item async for item in self.container.query_items(
+                        query=query,
+                        parameters=[{"name": "@ids", "value": chunk}],
+                        **INTEGRATED_CACHE_OPTIONS
+                    )
+                ]
+            except Exception as e:
+                logger.error(f"Error reading {len(chunk)} records from Cosmos DB: {e}")
+                return []
+        
+        chunks = [record_ids[i:i + chunk_size] for i in range(0, len(record_ids), chunk_size)]
+        pages = await asyncio.gather(*(read_chunk(chunk) for chunk in chunks))
+        
+        return {item['id']: item for page in pages for item in page}
+    
+    async def _fetch_item_record(self, record_id, item, start_time):
+        """Resolve a Cosmos DB item to its full record, downloading from blob storage if migrated"""
+        if self._is_record_in_tier1(item):
+            return self._record_found(record_id, item, 'tier1-cosmos', start_time)
+        
+        location = self._blob_location(item)
+        record, source = await self._search_blob_tier(*location)
+        
+        if record:
+            self._metadata_cache.put(record_id, location)
+            return self._record_found(record_id, record, source, start_time)
+        
+        return self._record_not_found(record_id, start_time)
+    
+    async def warm_cache(self, top_k=10000):
+        """
+        Prefetch the most recently written records into the in-process caches
+        Warming does not count towards the hit/miss statistics
+        Returns: number of records cached
+        """
+        logger.info(f"🔥 Warming cache with up to {top_k} recent records")
+        
+        try:
+            record_ids = [
+                record_id async for record_id in self.container.query_items(
+                    query=WARM_CACHE_QUERY,
+                    parameters=[{"name": "@top_k", "value": top_k}]
+                )
+            ]
+        except Exception as e:
+            logger.error(f"Error querying recent records for cache warming: {e}")
+            return 0
+        
+        items = await self._read_items_by_ids(record_ids)
+        
+        async def warm_one(record_id, item):
+            if self._is_record_in_tier1(item):
+                self._record_cache.put(record_id, item)
+                return True
+            
+            location = self._blob_location(item)
+            record, _ = await self._search_blob_tier(*location)
+            if record:
+                self._metadata_cache.put(record_id, location)
+                self._record_cache.put(record_id, record)
+            return bool(record)
+        
+        warmed = sum(await asyncio.gather(*(warm_one(record_id, item) for record_id, item in items.items())))
+        
+        logger.info(f"Cache warmed with {warmed} records")
+        return warmed
+    
+    def start_cache_warmer(self, top_k=10000, interval_seconds=300):
+        """Warm the cache now and then every interval_seconds as a task on the running loop"""
+        if self._cache_warmer is not None:
+            return
+        
+        async def run():
+            while True:
+                await self.warm_cache(top_k)
+                await asyncio.sleep(interval_seconds)
+        
+        self._cache_warmer = asyncio.get_running_loop().create_task(run())
+    
+    def stop_cache_warmer(self):
+        """Cancel the background cache warmer started by start_cache_warmer()"""
+        if self._cache_warmer is not None:
+            self._cache_warmer.cancel()
+            self._cache_warmer = None
+    
+    async def get_records_by_customer(self, customer_id, limit=100):
+        """
+        Get records for a specific customer across all tiers
+        Blob-backed records are downloaded concurrently
+        Returns: list of records sorted by creation date (newest first)
+        """
+        logger.info(f"🔍 Searching for records by customer {customer_id}")
+        
+        # (item, task) in Cosmos DB order, see TieredRetrieval
+        pending = []
+        
+        try:
+            query = CUSTOMER_RECORDS_QUERY
+            parameters = [
+                {"name": "@customer_id", "value": customer_id},
+                {"name": "@limit", "value": limit}
+            ]
+            
+            pages = self.container.query_items(
+                query=query,
+                parameters=parameters,
+                max_item_count=min(limit, CUSTOMER_QUERY_PAGE_SIZE),
+                **INTEGRATED_CACHE_OPTIONS
+            ).by_page()
+            
+            async for page in pages:
+                async for item in page:
+                    if self._is_record_in_tier1(item):
+                        pending.append((item, None))
+                    else:
+                        pending.append((item, asyncio.create_task(self._resolve_customer_record(item))))
+            
+            logger.info(f"Found {len(pending)} records for customer {customer_id}")
+            
+            results = []
+            for item, task in pending:
+                if task is None:
+                    record, source = item, 'tier1-cosmos'
+                else:
+                    record, source = await task
+                
+                if record:
+                    results.append({
+                        'record': record,
+                        'source': source,
+                        'record_id': item['id']
+                    })
+            
+            return results
+            
+        except Exception as e:
+            logger.error(f"Error retrieving records for customer {customer_id}: {e}")
+            return []
+        finally:
+            # After a failed page or download, or a cancelled call, the other
+            # downloads are stopped instead of left running unawaited
+            unfinished = [task for _, task in pending if task is not None and not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.gather(*unfinished, return_exceptions=True)
+    
+    async def _resolve_customer_record(self, item):
+        """Fetch the full record for a migrated Cosmos DB item from its blob tier"""
+        location = self._blob_location(item)
+        record, source = await self._search_blob_tier(*location)
+        if record:
+            self._metadata_cache.put(item['id'], location)
+        return record, source
+    
+    async def get_storage_statistics(self):
+        """
+        Get statistics about data distribution across storage tiers
+        """
+        logger.info("📊 Gathering storage tier statistics")
+        
+        stats = {
+            'tier1_cosmos': 0,
+            'tier2_hot_blob': 0,
+            'tier3_cold_blob': 0,
+            'total_records': 0,
+            # When the tier counts were computed (UTC, ISO 8601)
+            'tier_counts_updated_at': None,
+            'performance': self._get_performance_stats()
+        }
+        
+        try:
+            stats.update(await self._get_tier_counts())
+            logger.debug("Storage statistics gathered: %s", stats)
+            return stats
+            
+        except Exception as e:
+            logger.error(f"Error getting storage statistics: {e}")
+            return stats
+    
+    async def _get_tier_counts(self):
+        """
+        Record counts per storage tier, read from the counters document kept by the
+        migration job, or aggregated across partitions if it does not exist yet or
+        is older than TIER_COUNTERS_MAX_AGE
+        """
+        cached = self._recent_tier_counts()
+        if cached:
+            return cached
+        
+        try:
+            counters = await self.container.read_item(item=TIER_COUNTERS_ID, partition_key=TIER_COUNTERS_ID)
+        except exceptions.CosmosResourceNotFoundError:
+            counters = None
+        
+        if self._counters_are_fresh(counters):
+            return self._cache_tier_counts(counters.get('tiers', {}), counters['updatedAt'])
+        
+        groups = [
+            item async for item in self.container.query_items(
+                query=TIER_COUNTS_QUERY, **INTEGRATED_CACHE_OPTIONS
+            )
+        ]
+        return self._cache_tier_counts(self._fold_tier_groups(groups), datetime.utcnow().isoformat())
+
+# Shared TieredRetrieval used by the convenience functions, created on first use so
+# the Cosmos DB and Blob Storage connections are set up once per process
+_retrieval = None
+_retrieval_lock = threading.Lock()
+
+def _get_retrieval():
+    """Return the process-wide TieredRetrieval instance"""
+    global _retrieval
+    if _retrieval is None:
+        with _retrieval_lock:
+            if _retrieval is None:
+                _retrieval = TieredRetrieval()
+                
+                # Optional background prefetch of recently written records
+                warm_interval = int(os.getenv('CACHE_WARM_INTERVAL', '0'))
+                if warm_interval > 0:
+                    _retrieval.start_cache_warmer(
+                        top_k=int(os.getenv('CACHE_WARM_TOP_K', '10000')),
+                        interval_seconds=warm_interval
+                    )
+    return _retrieval
+
 # Convenience functions for easy usage
 def get_billing_record(record_id):
     """
     Simple function to get a billing record from any storage tier
     Usage: record = get_billing_record("record-id-123")
     """
-    retrieval = TieredRetrieval()
-    record, source, response_time = retrieval.get_billing_record(record_id)
+    record, source, response_time = _get_retrieval().get_billing_record(record_id)
     return record
 
 def get_billing_records(record_ids):
@@ -347,24 +1429,21 @@ def get_billing_records(record_ids):
     Get multiple billing records at once
     Usage: records = get_billing_records(["id1", "id2", "id3"])
     """
-    retrieval = TieredRetrieval()
-    return retrieval.get_multiple_records(record_ids)
+    return _get_retrieval().get_multiple_records(record_ids)
 
 def get_customer_records(customer_id, limit=100):
     """
     Get all records for a specific customer
     Usage: records = get_customer_records("customer-123")
     """
-    retrieval = TieredRetrieval()
-    return retrieval.get_records_by_customer(customer_id, limit)
+    return _get_retrieval().get_records_by_customer(customer_id, limit)
 
 def get_storage_stats():
     """
     Get current storage tier statistics
     Usage: stats = get_storage_stats()
     """
-    retrieval = TieredRetrieval()
-    return retrieval.get_storage_statistics()
+    return _get_retrieval().get_storage_statistics()
 
 # Example usage and testing
 if __name__ == "__main__":
@@ -385,7 +1464,7 @@ if __name__ == "__main__":
     
     if test_record_id:
         print(f"\n🔍 Testing retrieval for record: {test_record_id}")
-        record, source, response_time = TieredRetrieval().get_billing_record(test_record_id)
+        record, source, response_time = _get_retrieval().get_billing_record(test_record_id)
         
         if record:
             print(f"✅ Found record in {source} (took {response_time:.2f}ms)")
@@ -402,12 +1481,14 @@ if __name__ == "__main__":
     print(f"   Tier 2 (Hot Blob): {stats['tier2_hot_blob']:,} records")
     print(f"   Tier 3 (Cold Blob): {stats['tier3_cold_blob']:,} records")
     print(f"   Total: {stats['total_records']:,} records")
+    print(f"   Counted at: {stats['tier_counts_updated_at']} UTC")
     
     # Performance statistics
     perf = stats['performance']
     if perf['total_requests'] > 0:
         print(f"\n⚡ Performance Statistics:")
         print(f"   Total Requests: {perf['total_requests']}")
+        print(f"   In-Process Cache Hits: {perf['hit_distribution']['cache_percentage']:.1f}%")
         print(f"   Tier 1 Hits: {perf['hit_distribution']['tier1_percentage']:.1f}%")
         print(f"   Tier 2 Hits: {perf['hit_distribution']['tier2_percentage']:.1f}%")
         print(f"   Tier 3 Hits: {perf['hit_distribution']['tier3_percentage']:.1f}%")
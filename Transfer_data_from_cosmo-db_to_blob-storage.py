@@ -1,11 +1,35 @@
+import asyncio
+import contextlib
+import gzip
+import itertools
 import json
 import os
 import time
+import uuid
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
-from azure.cosmos import CosmosClient, exceptions
-from azure.storage.blob import BlobServiceClient
+from functools import partial
+import aiohttp
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.cosmos import exceptions
+from azure.cosmos.aio import CosmosClient
+from azure.storage.blob import BlobSasPermissions, ContentSettings, generate_blob_sas
+from azure.storage.blob.aio import BlobServiceClient
 import logging
 
+# orjson serializes records several times faster than the stdlib when it is installed
+# and returns bytes, so there is no separate encode step
+try:
+    import orjson
+    
+    def _json_dumps(obj, default=None):
+        return orjson.dumps(obj, default=default)
+except ImportError:
+    def _json_dumps(obj, default=None):
+        return json.dumps(obj, separators=(',', ':'), default=default).encode('utf-8')
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -13,23 +37,152 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Document holding per-tier record counts, read by Retrieval.get_storage_statistics().
+# Its id is also its partition key value, whatever the partition key path
+TIER_COUNTERS_ID = 'tier-counters'
+TIER_COUNTS_QUERY = """
+SELECT c.storage_tier, COUNT(1) as record_count
+FROM c
+WHERE c.id != 'tier-counters'
+GROUP BY c.storage_tier
+"""
+
+# Cosmos DB accepts at most 100 operations in one transactional batch
+COSMOS_BATCH_LIMIT = 100
+
+# Fields a record keeps in Cosmos DB once it is archived to blob storage: what
+# queries filter on and the blob location. The rest of the document only lives
+# in the blob, so Cosmos DB storage and write RUs stay at the size of this pointer
+POINTER_FIELDS = (
+    'id', 'customerId', 'createdAt', 'storage_tier', 'blob_path', 'blob_offset',
+    'blob_length', 'blob_size', 'record_size', 'blob_url', 'migrated_to_hot_at'
+)
+
+# Fields each migration changes in a record, written back with a patch. Migrations
+# not listed here replace the item with its (already slimmed) pointer document
+PATCHED_FIELDS = {
+    'tier2_to_tier3': ('storage_tier', 'blob_path', 'blob_size', 'blob_url', 'migrated_to_cold_at'),
+}
+
+# Error messages kept per migration for the summary; later failures are only
+# counted and logged, so a systemic failure cannot grow the list without bound
+MIGRATION_ERRORS_KEPT = 128
+
+# Seconds between status checks of a server-side blob copy that is still pending
+BLOB_COPY_POLL_INTERVAL = float(os.getenv('BLOB_COPY_POLL_INTERVAL', '0.5'))
+
+# Connections in the pool shared by all blob calls; aiohttp's default of 100 is
+# fewer than MIGRATION_CONCURRENCY x BLOB_MAX_CONCURRENCY transfers need
+BLOB_CONNECTION_POOL_SIZE = int(os.getenv('BLOB_CONNECTION_POOL_SIZE', '256'))
+
+# Query pages fetched ahead of the page being migrated, and pages whose uploads
+# and Cosmos DB writes may be in flight at once (each page holds up to 4 MB)
+MIGRATION_PREFETCH_PAGES = int(os.getenv('MIGRATION_PREFETCH_PAGES', '2'))
+MIGRATION_PAGES_IN_FLIGHT = int(os.getenv('MIGRATION_PAGES_IN_FLIGHT', '4'))
+
+# Throttled (429/503) and failed requests are retried by the SDKs with exponential
+# backoff before a record counts as failed; Cosmos DB also honors retry-after
+COSMOS_RETRY_TOTAL = int(os.getenv('COSMOS_RETRY_TOTAL', '10'))
+COSMOS_RETRY_BACKOFF_MAX = int(os.getenv('COSMOS_RETRY_BACKOFF_MAX', '30'))
+BLOB_RETRY_TOTAL = int(os.getenv('BLOB_RETRY_TOTAL', '6'))
+
+# Seconds no record of a partition is started after a write to it was still
+# throttled once the retries ran out
+PARTITION_COOLDOWN = float(os.getenv('PARTITION_COOLDOWN', '10'))
+
+# Records of one customer and day are packed into bundle blobs of at most this size
+BLOB_BUNDLE_MAX_BYTES = int(os.getenv('BLOB_BUNDLE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+class _BlobPathChars(dict):
+    """
+    str.translate() table mapping every character that is not alphanumeric, '_'
+    or '-' to '_'. Entries are added the first time a character is seen, so the
+    table covers any Unicode input while translate() itself runs in C.
+    """
+    
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        self[codepoint] = char if char.isalnum() or char in '_-' else '_'
+        return self[codepoint]
+
+_BLOB_PATH_CHARS = _BlobPathChars()
+
 class TieredDataTransfer:
+    """
+    Migrates records between storage tiers using the async Cosmos DB and Blob Storage
+    clients, so many records are in flight at once. Use as an async context manager:
+    
+        async with TieredDataTransfer() as transfer:
+            await transfer.run_full_migration()
+    """
+    
     def __init__(self):
         """Initialize connections to Cosmos DB and Blob Storage"""
         # Cosmos DB configuration
         self.cosmos_client = CosmosClient(
             url=os.getenv('COSMOS_ENDPOINT'),
-            credential=os.getenv('COSMOS_KEY')
+            credential=os.getenv('COSMOS_KEY'),
+            retry_total=COSMOS_RETRY_TOTAL,
+            retry_backoff_max=COSMOS_RETRY_BACKOFF_MAX
         )
         self.database = self.cosmos_client.get_database_client(os.getenv('COSMOS_DATABASE', 'billing-database'))
         self.container = self.database.get_container_client('billing-records')
+        # Updates sharing a value of this path are written in one transactional batch
+        self.partition_key_path = os.getenv('COSMOS_PARTITION_KEY_PATH', '/id')
+        # Distinct partition key values, read once per run, see _get_partition_keys()
+        self._partition_keys = None
+        # Partition key value -> time.monotonic() before which its records wait
+        self._cooldown_until = {}
         
-        # Blob Storage configuration
+        # Blob Storage configuration; blobs larger than one request are transferred
+        # as blocks, up to blob_max_concurrency at a time
+        self.blob_max_concurrency = int(os.getenv('BLOB_MAX_CONCURRENCY', '8'))
+        self.blob_max_block_size = int(os.getenv('BLOB_MAX_BLOCK_SIZE', str(8 * 1024 * 1024)))
         self.blob_client = BlobServiceClient.from_connection_string(
-            os.getenv('AZURE_STORAGE_CONNECTION_STRING')
+            os.getenv('AZURE_STORAGE_CONNECTION_STRING'),
+            max_block_size=self.blob_max_block_size,
+            # Waits 1, 3, 5, 9... seconds (plus jitter) between attempts
+            retry_total=BLOB_RETRY_TOTAL,
+            initial_backoff=1,
+            increment_base=2,
+            transport=AioHttpTransport(
+                # The SDK handles Content-Encoding itself; gzip blobs must arrive as stored
+                session=aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=BLOB_CONNECTION_POOL_SIZE),
+                    auto_decompress=False
+                ),
+                session_owner=True
+            )
         )
         self.hot_container = 'billing-hot'
         self.cold_container = 'billing-cold'
+        self._container_clients = {
+            name: self.blob_client.get_container_client(name)
+            for name in (self.hot_container, self.cold_container)
+        }
+        
+        # When set, migrated records also store a read-only SAS URL so readers
+        # can fetch the blob with a plain HTTPS GET
+        self.blob_sas_ttl_days = int(os.getenv('BLOB_SAS_TTL_DAYS', '0'))
+        
+        # gzip level for record blobs (0 stores plain JSON); Retrieval detects either
+        self.blob_gzip_level = int(os.getenv('BLOB_GZIP_LEVEL', '6'))
+        
+        # Bundle blob names start with the run id, so runs never overwrite each other
+        self.run_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self._bundle_sequence = itertools.count()
+        
+        # Migration timestamps, taken once per tier migration, see _stamp_migration()
+        self._stamp_migration()
+        
+        # Hot blobs copied to cold storage in this run, and how many of their records
+        # were found and moved; a hot blob is deleted once all of them are
+        self._cold_copies = {}
+        self._hot_blob_records = Counter()
+        self._hot_blob_moved = Counter()
+        
+        # Records migrated concurrently; all of them share the clients above
+        self.migration_concurrency = int(os.getenv('MIGRATION_CONCURRENCY', '64'))
         
         # Migration statistics
         self.stats = {
@@ -39,43 +192,75 @@ class TieredDataTransfer:
             'start_time': None,
             'end_time': None
         }
-        
-        # Create containers if they don't exist
-        self._create_containers()
     
-    def _create_containers(self):
-        """Create blob containers if they don't exist"""
-        containers = [self.hot_container, self.cold_container]
+    async def __aenter__(self):
+        try:
+            await self.cosmos_client.__aenter__()
+            await self.blob_client.__aenter__()
+            
+            # Create containers if they don't exist
+            await self._create_containers()
+        except BaseException:
+            # __aexit__ is not called when __aenter__ fails, so nothing else closes them
+            await self.close()
+            raise
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.close()
+    
+    async def close(self):
+        """Close the Cosmos DB and Blob Storage connections"""
+        await self.cosmos_client.close()
+        await self.blob_client.close()
+    
+    async def _create_containers(self):
+        """Create the blob containers that don't exist yet, found with one listing"""
+        try:
+            existing = {
+                container['name']
+                async for container in self.blob_client.list_containers(name_starts_with='billing-')
+            }
+        except Exception as e:
+            # E.g. a SAS without list permission; creating each one still works
+            logger.warning(f"Could not list blob containers, creating each one: {e}")
+            existing = set()
         
-        for container_name in containers:
+        for container_name, container_client in self._container_clients.items():
+            if container_name in existing:
+                logger.info(f"Container {container_name} already exists")
+                continue
             try:
-                container_client = self.blob_client.get_container_client(container_name)
-                container_client.create_container(public_access=None)
+                await container_client.create_container(public_access=None)
                 logger.info(f"Created container: {container_name}")
+            except ResourceExistsError:
+                # Created by another process since the listing
+                logger.info(f"Container {container_name} already exists")
             except Exception as e:
-                if "ContainerAlreadyExists" not in str(e):
-                    logger.error(f"Error creating container {container_name}: {e}")
-                else:
-                    logger.info(f"Container {container_name} already exists")
+                logger.error(f"Error creating container {container_name}: {e}")
     
-    def migrate_tier1_to_tier2(self, batch_size=100):
+    async def migrate_tier1_to_tier2(self, batch_size=-1):
         """
         Migrate data from Tier 1 (Cosmos DB) to Tier 2 (Hot Blob Storage)
         Records older than 1 month but newer than 3 months
+        batch_size is the query page size; -1 lets Cosmos DB fill each page (up to 4 MB)
         """
         logger.info("Starting Tier 1 → Tier 2 migration (1-month old data)")
         
-        # Calculate date ranges
-        one_month_ago = datetime.utcnow() - timedelta(days=30)
-        three_months_ago = datetime.utcnow() - timedelta(days=90)
+        # Calculate date ranges; whole days move together, so each day's bundle
+        # blobs hold every record of that day
+        today = self._stamp_migration().replace(hour=0, minute=0, second=0, microsecond=0)
+        one_month_ago = today - timedelta(days=30)
+        three_months_ago = today - timedelta(days=90)
         
-        # Query for records between 1-3 months old that haven't been migrated
+        # Query for records between 1-3 months old that haven't been migrated. No
+        # ORDER BY: records are independent, and a cross-partition ORDER BY makes the
+        # SDK buffer and merge pages from every partition
         query = """
         SELECT * FROM c 
         WHERE c.createdAt < @one_month_ago 
         AND c.createdAt >= @three_months_ago
         AND (c.storage_tier IS NULL OR c.storage_tier = 'cosmos')
-        ORDER BY c.createdAt ASC
         """
         
         parameters = [
@@ -84,44 +269,15 @@ class TieredDataTransfer:
         ]
         
         try:
-            # Execute query in batches
-            items = list(self.container.query_items(
-                query=query,
-                parameters=parameters,
-                enable_cross_partition_query=True,
-                max_item_count=batch_size
-            ))
-            
-            logger.info(f"Found {len(items)} records to migrate from Tier 1 to Tier 2")
+            # Execute query in batches; pages are consumed as they arrive, so uploads
+            # overlap with the query
+            pages = self._query_pages(query, parameters, batch_size)
             
-            for item in items:
-                try:
-                    # Generate blob path
-                    blob_path = self._generate_blob_path(item, 'hot')
-                    
-                    # Store in hot blob storage
-                    blob_size = self._store_in_blob(item, self.hot_container, blob_path)
-                    
-                    # Update record in Cosmos DB with migration info
-                    item['storage_tier'] = 'hot_blob'
-                    item['blob_path'] = blob_path
-                    item['migrated_to_hot_at'] = datetime.utcnow().isoformat()
-                    item['blob_size'] = blob_size
-                    
-                    # Replace item in Cosmos DB
-                    self.container.replace_item(item['id'], item)
-                    
-                    # Update statistics
-                    self.stats['tier1_to_tier2']['success'] += 1
-                    self.stats['total_size_migrated'] += blob_size
-                    
-                    logger.debug(f"Migrated record {item['id']} to hot blob storage ({blob_size} bytes)")
-                    
-                except Exception as e:
-                    error_msg = f"Record {item.get('id', 'unknown')}: {str(e)}"
-                    logger.error(f"Failed to migrate record to Tier 2: {error_msg}")
-                    self.stats['tier1_to_tier2']['failed'] += 1
-                    self.stats['tier1_to_tier2']['errors'].append(error_msg)
+            found = await self._migrate_items(
+                pages, self._pack_one_t1_t2, 'tier1_to_tier2', 'Tier 2',
+                write_blobs=self._upload_hot_bundles
+            )
+            logger.info(f"Processed {found} records from Tier 1 to Tier 2")
             
             logger.info(f"Tier 1 → Tier 2 migration completed. Success: {self.stats['tier1_to_tier2']['success']}, Failed: {self.stats['tier1_to_tier2']['failed']}")
             
@@ -129,21 +285,31 @@ class TieredDataTransfer:
             logger.error(f"Tier 1 → Tier 2 migration failed: {e}")
             raise
     
-    def migrate_tier2_to_tier3(self, batch_size=100):
+    async def _pack_one_t1_t2(self, item):
+        """
+        Serialize one Cosmos DB record for its hot bundle blob; the bundles of a page
+        are uploaded by _upload_hot_bundles
+        Returns: (serialized record, cleanup to run once the item is written)
+        """
+        return self._encode_record(item), None
+    
+    async def migrate_tier2_to_tier3(self, batch_size=-1):
         """
         Migrate data from Tier 2 (Hot Blob) to Tier 3 (Cold Blob Storage)
         Records older than 3 months
+        batch_size is the query page size; -1 lets Cosmos DB fill each page (up to 4 MB)
         """
         logger.info("Starting Tier 2 → Tier 3 migration (3-month old data)")
         
-        three_months_ago = datetime.utcnow() - timedelta(days=90)
+        today = self._stamp_migration().replace(hour=0, minute=0, second=0, microsecond=0)
+        three_months_ago = today - timedelta(days=90)
         
-        # Query for records older than 3 months currently in hot blob storage
-        query = """
-        SELECT * FROM c 
+        # Query for records older than 3 months currently in hot blob storage. The
+        # copy only needs the blob location, so the billing payload is not read
+        query = f"""
+        SELECT c.id, c._etag, c.blob_path, c.blob_length{self._partition_key_projection()} FROM c 
         WHERE c.createdAt < @three_months_ago 
         AND c.storage_tier = 'hot_blob'
-        ORDER BY c.createdAt ASC
         """
         
         parameters = [
@@ -151,51 +317,13 @@ class TieredDataTransfer:
         ]
         
         try:
-            items = list(self.container.query_items(
-                query=query,
-                parameters=parameters,
-                enable_cross_partition_query=True,
-                max_item_count=batch_size
-            ))
+            # Pages are consumed as they arrive, so uploads overlap with the query
+            pages = self._query_pages(query, parameters, batch_size)
             
-            logger.info(f"Found {len(items)} records to migrate from Tier 2 to Tier 3")
+            found = await self._migrate_items(pages, self._migrate_one_t2_t3, 'tier2_to_tier3', 'Tier 3')
+            logger.info(f"Processed {found} records from Tier 2 to Tier 3")
             
-            for item in items:
-                try:
-                    # Retrieve full record from hot blob storage
-                    full_record = self._retrieve_from_blob(self.hot_container, item['blob_path'])
-                    
-                    if full_record:
-                        # Generate new blob path for cold storage
-                        cold_blob_path = self._generate_blob_path(full_record, 'cold')
-                        
-                        # Store in cold blob storage
-                        blob_size = self._store_in_blob(full_record, self.cold_container, cold_blob_path)
-                        
-                        # Update record in Cosmos DB
-                        item['storage_tier'] = 'cold_blob'
-                        item['blob_path'] = cold_blob_path
-                        item['migrated_to_cold_at'] = datetime.utcnow().isoformat()
-                        item['blob_size'] = blob_size
-                        
-                        self.container.replace_item(item['id'], item)
-                        
-                        # Delete from hot blob storage
-                        self._delete_from_blob(self.hot_container, item['blob_path'])
-                        
-                        # Update statistics
-                        self.stats['tier2_to_tier3']['success'] += 1
-                        self.stats['total_size_migrated'] += blob_size
-                        
-                        logger.debug(f"Migrated record {item['id']} to cold blob storage")
-                    else:
-                        raise Exception("Could not retrieve record from hot blob storage")
-                    
-                except Exception as e:
-                    error_msg = f"Record {item.get('id', 'unknown')}: {str(e)}"
-                    logger.error(f"Failed to migrate record to Tier 3: {error_msg}")
-                    self.stats['tier2_to_tier3']['failed'] += 1
-                    self.stats['tier2_to_tier3']['errors'].append(error_msg)
+            await self._delete_moved_hot_blobs()
             
             logger.info(f"Tier 2 → Tier 3 migration completed. Success: {self.stats['tier2_to_tier3']['success']}, Failed: {self.stats['tier2_to_tier3']['failed']}")
             
@@ -203,8 +331,399 @@ class TieredDataTransfer:
             logger.error(f"Tier 2 → Tier 3 migration failed: {e}")
             raise
     
-    def _generate_blob_path(self, record, tier):
-        """Generate hierarchical blob path for organized storage"""
+    async def _migrate_one_t2_t3(self, item):
+        """
+        Point one record at the cold copy of its hot blob, copying the blob first
+        if no other record of this run has (the item is written back to Cosmos DB
+        by _commit_page)
+        Returns: (stored size of the record in bytes, cleanup to run once it is written)
+        """
+        hot_blob_path = item['blob_path']
+        self._hot_blob_records[hot_blob_path] += 1
+        
+        # Records of one bundle share a single copy
+        copy = self._cold_copies.get(hot_blob_path)
+        if copy is None:
+            copy = asyncio.create_task(self._copy_to_cold(hot_blob_path))
+            self._cold_copies[hot_blob_path] = copy
+        cold_blob_path, blob_size = await asyncio.shield(copy)
+        
+        # Update record in Cosmos DB; the byte range within the blob is unchanged
+        item['storage_tier'] = 'cold_blob'
+        item['blob_path'] = cold_blob_path
+        item['migrated_to_cold_at'] = self._migrated_at
+        item['blob_size'] = item.get('blob_length', blob_size)
+        self._set_blob_url(item, self.cold_container, cold_blob_path)
+        
+        logger.debug("Copied record %s to cold blob storage", item['id'])
+        
+        # The hot blob is deleted only after Cosmos DB points all its records at the cold one
+        return item['blob_size'], partial(self._hot_record_moved, hot_blob_path)
+    
+    async def _copy_to_cold(self, hot_blob_path):
+        """
+        Copy a hot blob (a bundle, or a single record migrated before bundling) to
+        the same path in cold storage
+        Returns: (cold blob path, size of the blob in bytes)
+        """
+        cold_blob_path = 'cold/' + hot_blob_path.split('/', 1)[-1]
+        
+        source = self._container_clients[self.hot_container].get_blob_client(hot_blob_path)
+        properties = await source.get_blob_properties()
+        metadata = dict(
+            properties.metadata,
+            migrated_at=self._migrated_at,
+            storage_tier=self.cold_container.replace('billing-', '')
+        )
+        
+        # Copy on the storage service; the records never pass through this process
+        try:
+            await self._copy_blob(
+                self.hot_container, hot_blob_path,
+                self.cold_container, cold_blob_path,
+                metadata
+            )
+        except Exception as e:
+            logger.warning("Server-side copy of %s failed, copying bytes instead: %s", hot_blob_path, e)
+            await self._copy_blob_bytes(
+                self.hot_container, hot_blob_path,
+                self.cold_container, cold_blob_path,
+                metadata, properties.content_settings
+            )
+        
+        return cold_blob_path, properties.size
+    
+    async def _hot_record_moved(self, hot_blob_path):
+        """Count a record whose Cosmos DB item now points at the cold copy of its hot blob"""
+        self._hot_blob_moved[hot_blob_path] += 1
+    
+    async def _delete_moved_hot_blobs(self):
+        """
+        Delete the hot blobs whose records were all moved to cold storage in this run;
+        a blob with a record that failed is kept for the next run
+        """
+        moved = [
+            path for path, count in self._hot_blob_records.items()
+            if self._hot_blob_moved[path] == count
+        ]
+        semaphore = asyncio.Semaphore(self.migration_concurrency)
+        
+        async def delete(path):
+            async with semaphore:
+                await self._delete_from_blob(self.hot_container, path)
+        
+        await asyncio.gather(*(delete(path) for path in moved))
+        logger.info(f"Deleted {len(moved)} hot blobs moved to cold storage")
+    
+    async def _query_pages(self, query, parameters, batch_size):
+        """
+        Yield the result pages of a migration query. With a shared partition key
+        (anything but /id) the query runs once per partition key value, each scoped
+        to a single partition, instead of fanning out to every partition.
+        """
+        if self.partition_key_path == '/id':
+            # Every record is its own partition, so per-key queries would mean one
+            # query per record
+            async for page in self.container.query_items(
+                query=query,
+                parameters=parameters,
+                max_item_count=batch_size
+            ).by_page():
+                yield page
+            return
+        
+        for partition_key in await self._get_partition_keys():
+            async for page in self.container.query_items(
+                query=query,
+                parameters=parameters,
+                partition_key=partition_key,
+                max_item_count=batch_size
+            ).by_page():
+                yield page
+    
+    async def _get_partition_keys(self):
+        """Distinct partition key values in the container, queried once per run"""
+        if self._partition_keys is None:
+            path = "".join(f'["{part}"]' for part in self.partition_key_path.strip('/').split('/'))
+            self._partition_keys = [
+                value async for value in self.container.query_items(
+                    query=f"SELECT DISTINCT VALUE c{path} FROM c"
+                )
+            ]
+            logger.info(f"Found {len(self._partition_keys)} partition key values")
+        return self._partition_keys
+    
+    async def _migrate_items(self, pages, migrate_one, stats_key, target_tier, write_blobs=None):
+        """
+        Run migrate_one for every item of the query pages with up to
+        migration_concurrency blob copies in flight, then write each page's
+        Cosmos DB updates with _commit_page. Pages are fetched by a separate task
+        into a bounded queue, so the query keeps running while records are copied;
+        both wait when the queue or MIGRATION_PAGES_IN_FLIGHT is full, so only a
+        bounded number of records is held in memory.
+        write_blobs, if given, stores each page's migrate_one results first.
+        Returns: number of records processed
+        """
+        semaphore = asyncio.Semaphore(self.migration_concurrency)
+        page_slots = asyncio.Semaphore(MIGRATION_PAGES_IN_FLIGHT)
+        queue = asyncio.Queue(maxsize=MIGRATION_PREFETCH_PAGES)
+        commits = set()
+        found = 0
+        
+        async def fetch_pages():
+            try:
+                async for page in pages:
+                    await queue.put([item async for item in page])
+            except asyncio.CancelledError:
+                # Cancelled once nothing reads the queue any more, so no end marker
+                raise
+            except Exception:
+                # A failed query ends the pages too; it is re-raised by `await fetcher`
+                await queue.put(None)
+                raise
+            await queue.put(None)
+        
+        async def copy_one(item):
+            try:
+                await self._wait_for_cooldown(item)
+                return await migrate_one(item)
+            finally:
+                semaphore.release()
+        
+        async def commit(copies):
+            try:
+                await self._commit_page(copies, stats_key, target_tier, write_blobs)
+            finally:
+                page_slots.release()
+        
+        fetcher = asyncio.create_task(fetch_pages())
+        try:
+            while True:
+                page = await queue.get()
+                if page is None:
+                    break
+                
+                await page_slots.acquire()
+                copies = []
+                for item in page:
+                    await semaphore.acquire()
+                    copies.append((item, asyncio.create_task(copy_one(item))))
+                    found += 1
+                
+                task = asyncio.create_task(commit(copies))
+                commits.add(task)
+                task.add_done_callback(commits.discard)
+            
+            await fetcher
+        finally:
+            if not fetcher.done():
+                # The loop above failed; stop the query and let it unwind before returning
+                fetcher.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await fetcher
+            if commits:
+                await asyncio.gather(*commits)
+        return found
+    
+    async def _commit_page(self, copies, stats_key, target_tier, write_blobs=None):
+        """
+        Wait for a page of blob copies, write the updated items to Cosmos DB and
+        record each outcome under self.stats[stats_key]
+        """
+        copied = []
+        for item, task in copies:
+            try:
+                blob_size, cleanup = await task
+                copied.append((item, blob_size, cleanup))
+            except Exception as e:
+                self._record_failure(stats_key, target_tier, item, e)
+        
+        if write_blobs:
+            copied, failed = await write_blobs(copied)
+            for item, e in failed:
+                self._record_failure(stats_key, target_tier, item, e)
+        
+        errors = await self._write_items([item for item, _, _ in copied], PATCHED_FIELDS.get(stats_key))
+        if write_blobs:
+            await self._delete_orphaned_bundles(copied, errors)
+        
+        cleanups = []
+        for item, blob_size, cleanup in copied:
+            if item['id'] in errors:
+                self._record_failure(stats_key, target_tier, item, errors[item['id']])
+                continue
+            
+            self.stats[stats_key]['success'] += 1
+            self.stats['total_size_migrated'] += blob_size
+            if cleanup:
+                cleanups.append(cleanup())
+        
+        await asyncio.gather(*cleanups)
+    
+    async def _delete_orphaned_bundles(self, stored, errors):
+        """
+        Delete the hot bundles uploaded for a page whose Cosmos DB writes all failed:
+        no item points at them, and the next run bundles their records again
+        """
+        referenced = {item['blob_path'] for item, _, _ in stored if item['id'] not in errors}
+        orphaned = {item['blob_path'] for item, _, _ in stored} - referenced
+        
+        for blob_path in orphaned:
+            logger.warning("No record of hot blob %s was written to Cosmos DB, deleting it", blob_path)
+        await asyncio.gather(*(self._delete_from_blob(self.hot_container, path) for path in orphaned))
+    
+    def _record_failure(self, stats_key, target_tier, item, error):
+        """Count and log a record that could not be migrated"""
+        error_msg = f"Record {item.get('id', 'unknown')}: {str(error)}"
+        logger.error("Failed to migrate record to %s: %s", target_tier, error_msg)
+        self.stats[stats_key]['failed'] += 1
+        errors = self.stats[stats_key]['errors']
+        if len(errors) < MIGRATION_ERRORS_KEPT:
+            errors.append(error_msg)
+    
+    async def _write_items(self, items, fields=None):
+        """
+        Write updated items back to Cosmos DB with one transactional batch per
+        partition key value. Items are patched with just the given fields, or
+        replaced whole without them; single items use patch_item/replace_item.
+        A write only applies if the item is unchanged since it was queried (its _etag).
+        Returns: dict of record_id -> exception for the items that were not written
+        """
+        groups = defaultdict(list)
+        for item in items:
+            groups[self._partition_key_value(item)].append(item)
+        
+        writes = []
+        for partition_key, group in groups.items():
+            if partition_key is None:
+                # Items without a partition key value are written one by one
+                writes.extend((None, [item]) for item in group)
+                continue
+            for offset in range(0, len(group), COSMOS_BATCH_LIMIT):
+                writes.append((partition_key, group[offset:offset + COSMOS_BATCH_LIMIT]))
+        
+        def patch_operations(item):
+            return [{'op': 'set', 'path': f'/{field}', 'value': item.get(field)} for field in fields]
+        
+        def operation(item):
+            if fields is None:
+                return 'replace', (item['id'], item), {'if_match_etag': item['_etag']}
+            return 'patch', (item['id'], patch_operations(item)), {'if_match_etag': item['_etag']}
+        
+        async def write(partition_key, batch):
+            try:
+                if len(batch) > 1:
+                    await self.container.execute_item_batch(
+                        batch_operations=[operation(item) for item in batch],
+                        partition_key=partition_key
+                    )
+                elif fields is None:
+                    await self.container.replace_item(
+                        batch[0]['id'], batch[0],
+                        etag=batch[0]['_etag'],
+                        match_condition=MatchConditions.IfNotModified
+                    )
+                else:
+                    await self.container.patch_item(
+                        batch[0]['id'], partition_key,
+                        patch_operations=patch_operations(batch[0]),
+                        etag=batch[0]['_etag'],
+                        match_condition=MatchConditions.IfNotModified
+                    )
+                return {}
+            except Exception as e:
+                if getattr(e, 'status_code', None) in (429, 503):
+                    self._start_cooldown(batch[0])
+                # A transactional batch fails or succeeds as a whole, so a record
+                # changed since the query fails its whole batch until the next run
+                return {item['id']: e for item in batch}
+        
+        errors = {}
+        results = await asyncio.gather(*(write(partition_key, batch) for partition_key, batch in writes))
+        for result in results:
+            errors.update(result)
+        return errors
+    
+    def _cooldown_key(self, item):
+        """
+        Cooldown an item belongs to: its partition key value, or one shared
+        cooldown with /id, where every record is its own logical partition
+        """
+        if self.partition_key_path == '/id':
+            return None
+        return self._partition_key_value(item)
+    
+    def _start_cooldown(self, item):
+        """Hold back new records of an item's partition for PARTITION_COOLDOWN seconds"""
+        self._cooldown_until[self._cooldown_key(item)] = time.monotonic() + PARTITION_COOLDOWN
+        logger.warning("Cosmos DB is throttling partition of record %s, pausing it for %ss", item['id'], PARTITION_COOLDOWN)
+    
+    async def _wait_for_cooldown(self, item):
+        """Wait until the cooldown of an item's partition, if any, has passed"""
+        until = self._cooldown_until.get(self._cooldown_key(item))
+        if until is not None:
+            delay = until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+    
+    def _strip_payload(self, item):
+        """
+        Reduce an archived item to its pointer document (POINTER_FIELDS plus the
+        partition key field and the _etag the write is conditioned on)
+        """
+        keep = set(POINTER_FIELDS)
+        keep.add(self.partition_key_path.strip('/').split('/')[0])
+        keep.add('_etag')
+        for field in [field for field in item if field not in keep]:
+            del item[field]
+    
+    def _partition_key_projection(self):
+        """Query projection (', c["field"]') of the partition key's top-level field, empty for /id"""
+        if self.partition_key_path == '/id':
+            return ''
+        return f', c["{self.partition_key_path.strip("/").split("/")[0]}"]'
+    
+    def _partition_key_value(self, item):
+        """Value of the container's partition key path (e.g. /id, /customerId) in an item"""
+        value = item
+        for part in self.partition_key_path.strip('/').split('/'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+    
+    def _set_partition_key_value(self, item, value):
+        """Set the container's partition key path in an item, creating nested objects as needed"""
+        *parents, field = self.partition_key_path.strip('/').split('/')
+        for part in parents:
+            item = item.setdefault(part, {})
+        item[field] = value
+    
+    async def refresh_tier_counters(self):
+        """
+        Count records per storage tier and store the result in the counters document,
+        so readers get statistics from one point read instead of an aggregation
+        """
+        try:
+            tiers = {}
+            async for item in self.container.query_items(query=TIER_COUNTS_QUERY):
+                # Records never migrated have no storage_tier
+                tier = item.get('storage_tier') or 'cosmos'
+                tiers[tier] = tiers.get(tier, 0) + item.get('record_count', 0)
+            
+            counters = {
+                'id': TIER_COUNTERS_ID,
+                'tiers': tiers,
+                'updatedAt': datetime.utcnow().isoformat()
+            }
+            self._set_partition_key_value(counters, TIER_COUNTERS_ID)
+            await self.container.upsert_item(counters)
+            logger.info(f"Updated tier counters: {tiers}")
+            
+        except Exception as e:
+            # Statistics fall back to a live aggregation, so this must not fail the run
+            logger.error(f"Failed to update tier counters: {e}")
+    
+    def _generate_blob_prefix(self, record, tier):
+        """Generate the hierarchical blob prefix of a record's bundle: one per customer and day"""
         try:
             # Parse creation date
             if isinstance(record['createdAt'], str):
@@ -218,80 +737,211 @@ class TieredDataTransfer:
             customer_id = record.get('customerId', 'unknown')
             
             # Sanitize customer ID for file path
-            safe_customer_id = "".join(c if c.isalnum() or c in ['_', '-'] else '_' for c in customer_id)
+            safe_customer_id = customer_id.translate(_BLOB_PATH_CHARS)
             
-            return f"{tier}/{year}/{month}/{day}/{safe_customer_id}/{record['id']}.json"
+            return f"{tier}/{year}/{month}/{day}/{safe_customer_id}"
             
         except Exception as e:
-            logger.error(f"Error generating blob path for record {record.get('id', 'unknown')}: {e}")
-            # Fallback path
-            return f"{tier}/error/{record['id']}.json"
+            logger.error("Error generating blob path for record %s: %s", record.get('id', 'unknown'), e)
+            # Fallback prefix, bundling the record on its own
+            return f"{tier}/error/{record['id']}"
     
-    def _store_in_blob(self, record, container_name, blob_path):
-        """Store record in blob storage with metadata"""
+    def _stamp_migration(self):
+        """
+        Take the time written to every record and blob of a tier migration, so the
+        clock is read and formatted once per migration instead of once per record
+        Returns: the current UTC time
+        """
+        now = datetime.utcnow()
+        self._migrated_at = now.isoformat()
+        self._sas_expiry = now + timedelta(days=self.blob_sas_ttl_days)
+        return now
+    
+    def _set_blob_url(self, item, container_name, blob_path):
+        """Store a read-only SAS URL for the record's blob, or drop a stale one"""
+        if not self.blob_sas_ttl_days:
+            item.pop('blob_url', None)
+            return
+        
+        sas_token = generate_blob_sas(
+            account_name=self.blob_client.account_name,
+            container_name=container_name,
+            blob_name=blob_path,
+            account_key=self.blob_client.credential.account_key,
+            permission=BlobSasPermissions(read=True),
+            expiry=self._sas_expiry
+        )
+        blob_url = self._container_clients[container_name].get_blob_client(blob_path).url
+        item['blob_url'] = f"{blob_url}?{sas_token}"
+    
+    def _encode_record(self, record):
+        """
+        Serialize a record as one line of a bundle blob, gzip-compressed unless
+        disabled, and store its uncompressed size in the item
+        Returns: the encoded record
+        """
+        # Convert record to JSON with proper date handling
+        record_bytes = _json_dumps(record, default=self._json_serializer) + b'\n'
+        record['record_size'] = len(record_bytes)
+        
+        # Each record is its own gzip member: the concatenated members are a valid
+        # gzip file, and any one record can be read and decompressed by byte range
+        if self.blob_gzip_level:
+            record_bytes = gzip.compress(record_bytes, compresslevel=self.blob_gzip_level)
+        return record_bytes
+    
+    async def _upload_hot_bundles(self, packed):
+        """
+        Group a page of encoded records by customer and day and upload each group
+        as bundle blobs of at most BLOB_BUNDLE_MAX_BYTES
+        Returns: ([(item, stored size, cleanup)] for stored records, [(item, exception)] for the rest)
+        """
+        groups = defaultdict(list)
+        for item, record_bytes, _ in packed:
+            groups[self._generate_blob_prefix(item, 'hot')].append((item, record_bytes))
+        
+        bundles = []
+        for prefix, records in groups.items():
+            bundle, bundle_size = [], 0
+            for item, record_bytes in records:
+                if bundle and bundle_size + len(record_bytes) > BLOB_BUNDLE_MAX_BYTES:
+                    bundles.append((prefix, bundle))
+                    bundle, bundle_size = [], 0
+                bundle.append((item, record_bytes))
+                bundle_size += len(record_bytes)
+            bundles.append((prefix, bundle))
+        
+        results = await asyncio.gather(
+            *(self._upload_bundle(prefix, bundle) for prefix, bundle in bundles),
+            return_exceptions=True
+        )
+        
+        stored, failed = [], []
+        for (prefix, bundle), result in zip(bundles, results):
+            if isinstance(result, Exception):
+                failed.extend((item, result) for item, _ in bundle)
+            else:
+                stored.extend(result)
+        return stored, failed
+    
+    async def _upload_bundle(self, prefix, bundle):
+        """
+        Upload encoded records as one hot bundle blob and point each item at its
+        byte range within it
+        Returns: [(item, stored size, cleanup)] for the records of the bundle
+        """
+        blob_path = f"{prefix}/{self.run_id}-{next(self._bundle_sequence):06d}.ndjson"
+        if self.blob_gzip_level:
+            blob_path += '.gz'
+        blob_data = b''.join(record_bytes for _, record_bytes in bundle)
+        
         try:
-            blob_client = self.blob_client.get_blob_client(
-                container=container_name,
-                blob=blob_path
+            blob_client = self._container_clients[self.hot_container].get_blob_client(blob_path)
+            await blob_client.upload_blob(
+                blob_data,
+                overwrite=True,
+                max_concurrency=self.blob_max_concurrency,
+                content_settings=self._content_settings(blob_data, 'application/x-ndjson'),
+                metadata=self._bundle_metadata(bundle[0][0], self.hot_container, len(bundle))
             )
+        except Exception as e:
+            logger.error("Error storing blob %s: %s", blob_path, e)
+            raise
+        
+        # Update records in Cosmos DB with migration info
+        stored = []
+        offset = 0
+        for item, record_bytes in bundle:
+            item['storage_tier'] = 'hot_blob'
+            item['blob_path'] = blob_path
+            item['blob_offset'] = offset
+            item['blob_length'] = len(record_bytes)
+            item['blob_size'] = len(record_bytes)
+            item['migrated_to_hot_at'] = self._migrated_at
+            self._set_blob_url(item, self.hot_container, blob_path)
+            self._strip_payload(item)
+            stored.append((item, len(record_bytes), None))
+            offset += len(record_bytes)
+        
+        logger.debug("Stored %d records in hot blob %s (%d bytes)", len(bundle), blob_path, len(blob_data))
+        return stored
+    
+    @staticmethod
+    def _content_settings(blob_data, content_type='application/json'):
+        """Content settings, marking gzip-compressed payloads by their magic bytes"""
+        if blob_data[:2] == b'\x1f\x8b':
+            return ContentSettings(content_type=content_type, content_encoding='gzip')
+        return ContentSettings(content_type=content_type)
+    
+    def _bundle_metadata(self, record, container_name, record_count):
+        """Blob metadata describing a bundle of migrated records"""
+        return {
+            'customer_id': record.get('customerId', ''),
+            'created_date': str(record.get('createdAt', ''))[:10],
+            'record_count': str(record_count),
+            'migrated_at': self._migrated_at,
+            'storage_tier': container_name.replace('billing-', '')
+        }
+    
+    async def _copy_blob(self, source_container, source_path, target_container, target_path, metadata):
+        """
+        Copy a blob to another container of the same storage account on the service
+        side, waiting until the copy has finished
+        """
+        try:
+            source = self._container_clients[source_container].get_blob_client(source_path)
+            target = self._container_clients[target_container].get_blob_client(target_path)
             
-            # Convert record to JSON with proper date handling
-            record_json = json.dumps(record, indent=2, default=self._json_serializer)
-            record_bytes = record_json.encode('utf-8')
-            blob_size = len(record_bytes)
+            # Same-account copies are authorized by the destination request itself
+            copy = await target.start_copy_from_url(source.url, metadata=metadata)
+            status = copy['copy_status']
             
-            # Upload with metadata and proper content type
-            blob_client.upload_blob(
-                record_bytes,
-                overwrite=True,
-                content_settings={
-                    'content_type': 'application/json',
-                    'content_encoding': 'utf-8'
-                },
-                metadata={
-                    'record_id': record['id'],
-                    'customer_id': record.get('customerId', ''),
-                    'created_at': str(record.get('createdAt', '')),
-                    'migrated_at': datetime.utcnow().isoformat(),
-                    'original_size': str(blob_size),
-                    'storage_tier': container_name.replace('billing-', '')
-                }
-            )
+            while status == 'pending':
+                await asyncio.sleep(BLOB_COPY_POLL_INTERVAL)
+                properties = await target.get_blob_properties()
+                status = properties.copy.status
             
-            return blob_size
+            if status != 'success':
+                raise Exception(f"Blob copy ended with status {status}")
             
         except Exception as e:
-            logger.error(f"Error storing blob {blob_path}: {e}")
+            logger.debug("Error copying blob %s to %s: %s", source_path, target_container, e)
             raise
     
-    def _retrieve_from_blob(self, container_name, blob_path):
-        """Retrieve record from blob storage"""
+    async def _copy_blob_bytes(self, source_container, source_path, target_container, target_path, metadata, content_settings):
+        """
+        Copy a blob by downloading and re-uploading its bytes unchanged
+        Returns: size of the copied blob in bytes
+        """
         try:
-            blob_client = self.blob_client.get_blob_client(
-                container=container_name,
-                blob=blob_path
-            )
+            source = self._container_clients[source_container].get_blob_client(source_path)
+            target = self._container_clients[target_container].get_blob_client(target_path)
+            
+            downloader = await source.download_blob(max_concurrency=self.blob_max_concurrency)
+            blob_data = await downloader.readall()
             
-            blob_data = blob_client.download_blob().readall()
-            record = json.loads(blob_data.decode('utf-8'))
-            return record
+            await target.upload_blob(
+                blob_data,
+                overwrite=True,
+                max_concurrency=self.blob_max_concurrency,
+                content_settings=content_settings,
+                metadata=metadata
+            )
+            return len(blob_data)
             
         except Exception as e:
-            logger.error(f"Error retrieving blob {blob_path}: {e}")
-            return None
+            logger.error("Error copying blob %s to %s: %s", source_path, target_container, e)
+            raise
     
-    def _delete_from_blob(self, container_name, blob_path):
+    async def _delete_from_blob(self, container_name, blob_path):
         """Delete record from blob storage"""
         try:
-            blob_client = self.blob_client.get_blob_client(
-                container=container_name,
-                blob=blob_path
-            )
-            blob_client.delete_blob(delete_snapshots="include")
-            logger.debug(f"Deleted blob: {blob_path}")
+            blob_client = self._container_clients[container_name].get_blob_client(blob_path)
+            await blob_client.delete_blob(delete_snapshots="include")
+            logger.debug("Deleted blob: %s", blob_path)
             
         except Exception as e:
-            logger.error(f"Error deleting blob {blob_path}: {e}")
+            logger.error("Error deleting blob %s: %s", blob_path, e)
     
     def _json_serializer(self, obj):
         """Custom JSON serializer for datetime objects"""
@@ -299,7 +949,7 @@ class TieredDataTransfer:
             return obj.isoformat()
         raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
     
-    def run_full_migration(self):
+    async def run_full_migration(self):
         """Run complete migration process for both tiers"""
         self.stats['start_time'] = datetime.utcnow()
         
@@ -307,10 +957,13 @@ class TieredDataTransfer:
         
         try:
             # Migrate 1-month old data from Cosmos to Hot Blob
-            self.migrate_tier1_to_tier2()
+            await self.migrate_tier1_to_tier2()
             
             # Migrate 3-month old data from Hot Blob to Cold Blob
-            self.migrate_tier2_to_tier3()
+            await self.migrate_tier2_to_tier3()
+            
+            # Record the new distribution for storage statistics
+            await self.refresh_tier_counters()
             
         except Exception as e:
             logger.error(f"Migration process failed: {e}")
@@ -326,30 +979,39 @@ class TieredDataTransfer:
         total_failed = self.stats['tier1_to_tier2']['failed'] + self.stats['tier2_to_tier3']['failed']
         size_mb = self.stats['total_size_migrated'] / (1024 * 1024)
         
-        print("\n" + "="*60)
-        print("MIGRATION SUMMARY")
-        print("="*60)
-        print(f"Duration: {duration:.2f} seconds")
-        print(f"Total Records Processed: {total_success + total_failed}")
-        print(f"Successfully Migrated: {total_success}")
-        print(f"Failed Migrations: {total_failed}")
-        print(f"Total Data Migrated: {size_mb:.2f} MB")
-        print()
-        print("Tier 1 → Tier 2 (Cosmos → Hot Blob):")
-        print(f"  Success: {self.stats['tier1_to_tier2']['success']}")
-        print(f"  Failed: {self.stats['tier1_to_tier2']['failed']}")
-        print()
-        print("Tier 2 → Tier 3 (Hot Blob → Cold Blob):")
-        print(f"  Success: {self.stats['tier2_to_tier3']['success']}")
-        print(f"  Failed: {self.stats['tier2_to_tier3']['failed']}")
+        lines = [
+            "",
+            "="*60,
+            "MIGRATION SUMMARY",
+            "="*60,
+            f"Duration: {duration:.2f} seconds",
+            f"Total Records Processed: {total_success + total_failed}",
+            f"Successfully Migrated: {total_success}",
+            f"Failed Migrations: {total_failed}",
+            f"Total Data Migrated: {size_mb:.2f} MB",
+            "",
+            "Tier 1 → Tier 2 (Cosmos → Hot Blob):",
+            f"  Success: {self.stats['tier1_to_tier2']['success']}",
+            f"  Failed: {self.stats['tier1_to_tier2']['failed']}",
+            "",
+            "Tier 2 → Tier 3 (Hot Blob → Cold Blob):",
+            f"  Success: {self.stats['tier2_to_tier3']['success']}",
+            f"  Failed: {self.stats['tier2_to_tier3']['failed']}"
+        ]
         
         if total_failed > 0:
-            print("\nFirst 5 Errors:")
+            lines.append("\nFirst 5 Errors:")
             all_errors = self.stats['tier1_to_tier2']['errors'] + self.stats['tier2_to_tier3']['errors']
             for i, error in enumerate(all_errors[:5]):
-                print(f"  {i+1}. {error}")
+                lines.append(f"  {i+1}. {error}")
         
-        print("="*60)
+        lines.append("="*60)
+        print("\n".join(lines))
+
+async def run_migration():
+    """Run a full migration with connections opened and closed around it"""
+    async with TieredDataTransfer() as transfer:
+        await transfer.run_full_migration()
 
 def main():
     """Main execution function"""
@@ -368,8 +1030,7 @@ def main():
     
     try:
         # Initialize and run migration
-        transfer = TieredDataTransfer()
-        transfer.run_full_migration()
+        asyncio.run(run_migration())
         
         print("✅ Migration completed successfully!")
         
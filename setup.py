@@ -1,20 +1,246 @@
+"""
+One-click setup script for Azure Tiered Storage
+Creates all necessary Azure resources and configurations
+"""
+
 import os
 import sys
 import json
 import time
+import shutil
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import cached_property
+
+# orjson parses and serializes several times faster than the stdlib when it is
+# installed; both helpers work with str so callers don't care which one is used
+try:
+    import orjson
+    
+    def _json_loads(data):
+        return orjson.loads(data)
+    
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    def _json_loads(data):
+        return json.loads(data)
+    
+    def _json_dumps(obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+# With the management SDKs installed, setup runs the ARM calls in-process instead
+# of starting one az process per step (see AzureTieredStorageSdkSetup)
+try:
+    from azure.identity import AzureCliCredential
+    from azure.mgmt.cosmosdb import CosmosDBManagementClient
+    from azure.mgmt.resource import ResourceManagementClient
+    from azure.mgmt.storage import StorageManagementClient
+except ImportError:
+    AzureCliCredential = None
+
+# After az returns from a create, the resource's provisioningState is polled until
+# it reports Succeeded before anything is created inside it. Polls back off from 1s
+# up to this interval (seconds), so resources that are already ready are seen early
+PROVISIONING_POLL_INTERVAL = 5
+PROVISIONING_TIMEOUT = 30 * 60
+
+# The signed-in account is read from the CLI's profile file while it is younger
+# than this (seconds), instead of starting the CLI for `az account show`
+AZURE_PROFILE_MAX_AGE = 24 * 60 * 60
+
+# Progress of an unfinished setup, so a rerun reuses its resource names and skips
+# the steps that already succeeded; removed once a setup completes
+SETUP_STATE_FILE = os.getenv(
+    'SETUP_STATE_FILE', os.path.join(os.path.expanduser('~'), '.azure-tiered-setup-state.json')
+)
+
+# Blob containers used by the transfer and retrieval scripts
+BLOB_CONTAINERS = ['billing-hot', 'billing-cold']
+
+# Applied when Blob_Storage_Policy.json is not next to the script
+DEFAULT_LIFECYCLE_POLICY = {
+    "rules": [
+        {
+            "name": "MoveHotToColdAfter90Days",
+            "enabled": True,
+            "type": "Lifecycle",
+            "definition": {
+                "filters": {
+                    "blobTypes": ["blockBlob"],
+                    "prefixMatch": ["billing-hot/"]
+                },
+                "actions": {
+                    "baseBlob": {
+                        "tierToCool": {
+                            "daysAfterModificationGreaterThan": 90
+                        }
+                    }
+                }
+            }
+        }
+    ]
+}
 
 class AzureTieredStorageSetup:
     def __init__(self):
-        self.resource_group = f"billing-tiered-storage-{int(time.time())}"
+        # A previous run that failed partway is resumed with its own names
+        state = self._load_state()
+        
+        # One timestamp for all names, so every resource of a run shares its suffix
+        timestamp = state.get('timestamp') or int(time.time())
+        self.timestamp = timestamp
+        self.resource_group = f"billing-tiered-storage-{timestamp}"
         self.location = "eastus"
-        self.cosmos_account = f"billing-cosmos-{int(time.time())}"
-        self.storage_account = f"billing{str(int(time.time()))[-8:]}"  # Keep it short
+        self.cosmos_account = f"billing-cosmos-{timestamp}"
+        self.storage_account = f"billing{timestamp % 100_000_000:08d}"  # Keep it short
         self.cosmos_database = "billing-database"
         self.cosmos_container = "billing-records"
         
-        self.created_resources = []
+        # Appended to from worker threads, see _record_resource() and _run_step()
+        self.created_resources = state.get('created_resources', [])
+        self.completed_steps = set(state.get('completed_steps', []))
+        self._resources_lock = threading.Lock()
+        
+        # Subscription every command targets, set by check_prerequisites()
+        self.subscription_id = None
+        
+        # Shared by every command built with _az_group_cmd()
+        self._group_args = ('--resource-group', self.resource_group)
+    
+    def _az_group_cmd(self, *command, **options):
+        """
+        Build an az command that targets the resource group; keyword options
+        become flags, e.g. account_name='x' -> --account-name x
+        Returns: argument list for _run_az/_spawn/_az_tsv
+        """
+        cmd = ['az', *command, *self._group_args]
+        for option, value in options.items():
+            cmd += [f"--{option.replace('_', '-')}", value]
+        return cmd
+    
+    def _spawn(self, cmd):
+        """
+        Start an Azure CLI command (list form, no shell) without waiting for it.
+        Once the subscription is known it is passed explicitly, so az skips
+        resolving the default one
+        Returns: subprocess.Popen, to be finished with _wait_az
+        """
+        if self.subscription_id:
+            cmd = cmd + ['--subscription', self.subscription_id]
+        return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    
+    def _wait_az(self, process):
+        """
+        Wait for a command started by _spawn and collect its output
+        Returns: subprocess.CompletedProcess
+        """
+        stdout, stderr = process.communicate()
+        return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+    
+    def _run_az(self, cmd):
+        """
+        Run an Azure CLI command and capture its output; safe to call from
+        several threads at once
+        Returns: subprocess.CompletedProcess
+        """
+        return self._wait_az(self._spawn(cmd))
+    
+    def _az_tsv(self, cmd):
+        """
+        Run an Azure CLI command that prints a single --output tsv value, reading
+        stdout straight off the pipe and discarding stderr. Meant for polls whose
+        failures are retried rather than reported
+        Returns: the value, or None if the command failed
+        """
+        if self.subscription_id:
+            cmd = cmd + ['--subscription', self.subscription_id]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        with process.stdout:
+            output = process.stdout.read()
+        if process.wait() != 0:
+            return None
+        return output.decode('utf-8').strip()
+    
+    @cached_property
+    def account_info(self):
+        """
+        The signed-in account as reported by `az account show`, taken from the
+        CLI's azureProfile.json when it is recent enough
+        Returns: account dict, or None if not logged in
+        """
+        config_dir = os.path.expanduser(os.getenv('AZURE_CONFIG_DIR', os.path.join('~', '.azure')))
+        profile_path = os.path.join(config_dir, 'azureProfile.json')
+        try:
+            if time.time() - os.path.getmtime(profile_path) < AZURE_PROFILE_MAX_AGE:
+                # The CLI writes this file with a byte order mark
+                with open(profile_path, encoding='utf-8-sig') as f:
+                    for subscription in _json_loads(f.read()).get('subscriptions', []):
+                        if subscription.get('isDefault'):
+                            return subscription
+        except (OSError, ValueError):
+            pass
+        
+        result = self._run_az(['az', 'account', 'show'])
+        if result.returncode != 0:
+            return None
+        return _json_loads(result.stdout)
+    
+    def _record_resource(self, description):
+        """Remember a created resource for the summary, once even across resumed runs"""
+        with self._resources_lock:
+            # A rerun restores the list and may create the same resource again
+            if description not in self.created_resources:
+                self.created_resources.append(description)
+    
+    @staticmethod
+    def _load_state():
+        """
+        Read the progress left behind by an unfinished setup
+        Returns: state dict, empty if there is none
+        """
+        try:
+            with open(SETUP_STATE_FILE, 'r') as f:
+                return _json_loads(f.read())
+        except (OSError, ValueError):
+            return {}
+    
+    def _save_state(self):
+        """Write the current progress to SETUP_STATE_FILE; callers hold _resources_lock"""
+        state = {
+            'timestamp': self.timestamp,
+            'completed_steps': sorted(self.completed_steps),
+            'created_resources': self.created_resources
+        }
+        # Written next to the real file and renamed over it, so it is never half written
+        temp_path = f"{SETUP_STATE_FILE}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(_json_dumps(state))
+        os.replace(temp_path, SETUP_STATE_FILE)
+    
+    def _run_step(self, step, operation):
+        """
+        Run one setup step unless a previous run already completed it, and
+        record it as completed when it succeeds
+        Returns: True if the step is done
+        """
+        if step in self.completed_steps:
+            print(f"⏭️  Skipping {step}, completed by a previous run")
+            return True
+        
+        if not operation():
+            return False
+        
+        with self._resources_lock:
+            self.completed_steps.add(step)
+            self._save_state()
+        return True
+    
+    def _resource_group_exists(self):
+        """Returns: True if the resource group is still there"""
+        return self._az_tsv(['az', 'group', 'exists', '--name', self.resource_group, '--output', 'tsv']) == 'true'
     
     def check_prerequisites(self):
         """Check if Azure CLI is installed and user is logged in"""
@@ -22,24 +248,23 @@ class AzureTieredStorageSetup:
         
         try:
             # Check Azure CLI installation
-            result = subprocess.run(['az', '--version'], capture_output=True, text=True)
-            if result.returncode != 0:
+            if shutil.which('az') is None:
                 print("❌ Azure CLI is not installed. Please install it first.")
                 print("   Visit: https://docs.microsoft.com/en-us/cli/azure/install-azure-cli")
                 return False
             
             # Check if logged in
-            result = subprocess.run(['az', 'account', 'show'], capture_output=True, text=True)
-            if result.returncode != 0:
+            account_info = self.account_info
+            if not account_info:
                 print("❌ Not logged into Azure. Please run 'az login' first.")
                 return False
             
-            account_info = json.loads(result.stdout)
             print(f"✅ Logged into Azure as: {account_info.get('user', {}).get('name', 'Unknown')}")
             print(f"✅ Subscription: {account_info.get('name', 'Unknown')}")
             
+            self.subscription_id = account_info.get('id')
             return True
-            
+        
         except Exception as e:
             print(f"❌ Error checking prerequisites: {e}")
             return False
@@ -54,10 +279,10 @@ class AzureTieredStorageSetup:
             '--location', self.location
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = self._run_az(cmd)
         if result.returncode == 0:
             print(f"✅ Resource group created successfully")
-            self.created_resources.append(f"Resource Group: {self.resource_group}")
+            self._record_resource(f"Resource Group: {self.resource_group}")
             return True
         else:
             print(f"❌ Failed to create resource group: {result.stderr}")
@@ -65,36 +290,19 @@ class AzureTieredStorageSetup:
     
     def create_cosmos_db(self):
         """Create Cosmos DB account, database, and container"""
-        print(f"🌌 Creating Cosmos DB account: {self.cosmos_account}")
-        
-        # Create Cosmos DB account
-        cmd = [
-            'az', 'cosmosdb', 'create',
-            '--resource-group', self.resource_group,
-            '--name', self.cosmos_account,
-            '--default-consistency-level', 'Session',
-            '--locations', f'regionName={self.location}',
-            '--enable-automatic-failover'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Failed to create Cosmos DB account: {result.stderr}")
+        # The account takes minutes to provision, so a rerun keeps the one it has
+        if not self._run_step('cosmos_account', self._create_cosmos_account):
             return False
         
-        print("✅ Cosmos DB account created")
-        self.created_resources.append(f"Cosmos DB Account: {self.cosmos_account}")
-        
         # Create database
         print(f"📚 Creating database: {self.cosmos_database}")
-        cmd = [
-            'az', 'cosmosdb', 'sql', 'database', 'create',
-            '--resource-group', self.resource_group,
-            '--account-name', self.cosmos_account,
-            '--name', self.cosmos_database
-        ]
+        cmd = self._az_group_cmd(
+            'cosmosdb', 'sql', 'database', 'create',
+            account_name=self.cosmos_account,
+            name=self.cosmos_database
+        )
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = self._run_az(cmd)
         if result.returncode != 0:
             print(f"❌ Failed to create database: {result.stderr}")
             return False
@@ -103,17 +311,20 @@ class AzureTieredStorageSetup:
         
         # Create container
         print(f"📋 Creating container: {self.cosmos_container}")
-        cmd = [
-            'az', 'cosmosdb', 'sql', 'container', 'create',
-            '--resource-group', self.resource_group,
-            '--account-name', self.cosmos_account,
-            '--database-name', self.cosmos_database,
-            '--name', self.cosmos_container,
-            '--partition-key-path', '/id',
-            '--throughput', '400'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        cmd = self._az_group_cmd(
+            'cosmosdb', 'sql', 'container', 'create',
+            account_name=self.cosmos_account,
+            database_name=self.cosmos_database,
+            name=self.cosmos_container,
+            partition_key_path='/id',
+            throughput='400'
+        )
+        
+        # Indexing policy with the composite index used for per-customer lookups
+        if os.path.exists('Cosmos_Indexing_Policy.json'):
+            cmd += ['--idx', '@Cosmos_Indexing_Policy.json']
+        
+        result = self._run_az(cmd)
         if result.returncode != 0:
             print(f"❌ Failed to create container: {result.stderr}")
             return False
@@ -121,104 +332,195 @@ class AzureTieredStorageSetup:
         print("✅ Container created")
         return True
     
-    def create_storage_account(self):
-        """Create Storage Account with Hot and Cool tiers"""
+    def _create_cosmos_account(self):
+        """Create the Cosmos DB account and wait until it is provisioned"""
+        print(f"🌌 Creating Cosmos DB account: {self.cosmos_account}")
+        
+        # Deployed without waiting when the template is available, so the account is
+        # provisioned while the storage account steps run on the other thread
+        if os.path.exists('Cosmos_Account_Template.json'):
+            return self._deploy_cosmos_account()
+        
+        # Create Cosmos DB account; az cosmosdb create has no --no-wait and blocks
+        # until the account is provisioned
+        cmd = self._az_group_cmd(
+            'cosmosdb', 'create',
+            name=self.cosmos_account,
+            default_consistency_level='Session',
+            locations=f'regionName={self.location}'
+        ) + ['--enable-automatic-failover']
+        
+        result = self._run_az(cmd)
+        if result.returncode != 0:
+            print(f"❌ Failed to create Cosmos DB account: {result.stderr}")
+            return False
+        
+        print("✅ Cosmos DB account created")
+        self._record_resource(f"Cosmos DB Account: {self.cosmos_account}")
+        return True
+    
+    def _deploy_cosmos_account(self):
+        """Start a template deployment of the Cosmos DB account and poll it until it finishes"""
+        deployment = f"{self.cosmos_account}-account"
+        parameters = {
+            'accountName': {'value': self.cosmos_account},
+            'location': {'value': self.location}
+        }
+        cmd = self._az_group_cmd(
+            'deployment', 'group', 'create',
+            name=deployment,
+            template_file='Cosmos_Account_Template.json',
+            parameters=_json_dumps(parameters)
+        ) + ['--no-wait']
+        
+        # Returns once ARM has accepted (and validated) the deployment
+        result = self._run_az(cmd)
+        if result.returncode != 0:
+            print(f"❌ Failed to create Cosmos DB account: {result.stderr}")
+            return False
+        
+        show_cmd = self._az_group_cmd('deployment', 'group', 'show', name=deployment)
+        if not self._wait_until_provisioned(
+            show_cmd, f"Cosmos DB account {self.cosmos_account}", query='properties.provisioningState'
+        ):
+            return False
+        
+        print("✅ Cosmos DB account created")
+        self._record_resource(f"Cosmos DB Account: {self.cosmos_account}")
+        return True
+    
+    def _wait_until_provisioned(self, show_cmd, description, query='provisioningState'):
+        """
+        Poll the provisioning state an az show command reports at query until the
+        resource is provisioned, has failed, or PROVISIONING_TIMEOUT has passed
+        Returns: True if the resource reached Succeeded
+        """
+        deadline = time.monotonic() + PROVISIONING_TIMEOUT
+        attempt = 0
+        
+        while time.monotonic() < deadline:
+            # The resource may not be visible yet right after the create call
+            state = self._az_tsv(show_cmd + ['--query', query, '--output', 'tsv']) or ''
+            
+            if state == 'Succeeded':
+                return True
+            if state in ('Failed', 'Canceled'):
+                print(f"❌ Provisioning of {description} ended in state {state}")
+                return False
+            
+            time.sleep(min(2 ** attempt, PROVISIONING_POLL_INTERVAL))
+            attempt += 1
+        
+        print(f"❌ Timed out waiting for {description} to be provisioned")
+        return False
+    
+    def create_storage_account(self, containers=BLOB_CONTAINERS):
+        """Create Storage Account with Hot and Cool tiers and its blob containers"""
         print(f"💾 Creating storage account: {self.storage_account}")
         
-        cmd = [
-            'az', 'storage', 'account', 'create',
-            '--resource-group', self.resource_group,
-            '--name', self.storage_account,
-            '--location', self.location,
-            '--sku', 'Standard_LRS',
-            '--access-tier', 'Hot',
-            '--kind', 'StorageV2'
-        ]
+        cmd = self._az_group_cmd(
+            'storage', 'account', 'create',
+            name=self.storage_account,
+            location=self.location,
+            sku='Standard_LRS',
+            access_tier='Hot',
+            kind='StorageV2'
+        )
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = self._run_az(cmd)
         if result.returncode != 0:
             print(f"❌ Failed to create storage account: {result.stderr}")
             return False
         
+        # az waits for the create operation itself; containers and the lifecycle
+        # policy are still only sent once the account reports Succeeded, as they are
+        # rejected with StorageAccountIsNotProvisioned before that
+        show_cmd = self._az_group_cmd('storage', 'account', 'show', name=self.storage_account)
+        if not self._wait_until_provisioned(show_cmd, f"storage account {self.storage_account}"):
+            return False
+        
         print("✅ Storage account created")
-        self.created_resources.append(f"Storage Account: {self.storage_account}")
+        self._record_resource(f"Storage Account: {self.storage_account}")
         
-        # Create blob containers
-        containers = ['billing-hot', 'billing-cold']
+        # Create blob containers, all in one template deployment when the template is available
+        if os.path.exists('Blob_Containers_Template.json'):
+            return self._deploy_blob_containers(containers)
         
+        # They are independent, so every az process is started before waiting on any
+        processes = {}
         for container in containers:
             print(f"📦 Creating blob container: {container}")
-            cmd = [
+            processes[container] = self._spawn([
                 'az', 'storage', 'container', 'create',
                 '--name', container,
                 '--account-name', self.storage_account,
                 '--public-access', 'off'
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            ])
+        
+        success = True
+        for container, process in processes.items():
+            result = self._wait_az(process)
             if result.returncode != 0:
                 print(f"❌ Failed to create container {container}: {result.stderr}")
-                return False
-            
-            print(f"✅ Container {container} created")
+                success = False
+            else:
+                print(f"✅ Container {container} created")
         
-        return True
+        return success
     
-    def setup_lifecycle_policy(self):
-        """Apply lifecycle management policy to storage account"""
-        print("📋 Setting up blob lifecycle management policy...")
+    def _deploy_blob_containers(self, containers):
+        """Create all blob containers with a single ARM template deployment"""
+        print(f"📦 Creating blob containers: {', '.join(containers)}")
+        parameters = {
+            'storageAccountName': {'value': self.storage_account},
+            'containerNames': {'value': containers}
+        }
+        cmd = self._az_group_cmd(
+            'deployment', 'group', 'create',
+            name=f"{self.storage_account}-containers",
+            template_file='Blob_Containers_Template.json',
+            parameters=_json_dumps(parameters)
+        )
+        
+        result = self._run_az(cmd)
+        if result.returncode != 0:
+            print(f"❌ Failed to create blob containers: {result.stderr}")
+            return False
         
-        # Read the policy file
+        print(f"✅ Containers {', '.join(containers)} created")
+        return True
+    
+    @cached_property
+    def _lifecycle_policy(self):
+        """
+        The lifecycle policy from Blob_Storage_Policy.json, read once per run
+        Returns: policy dict, or DEFAULT_LIFECYCLE_POLICY if the file is missing
+        """
         try:
             with open('Blob_Storage_Policy.json', 'r') as f:
-                policy = json.load(f)
+                return _json_loads(f.read())
         except FileNotFoundError:
             print("⚠️  Blob_Storage_Policy.json not found, creating default policy...")
-            policy = {
-                "rules": [
-                    {
-                        "name": "MoveHotToColdAfter90Days",
-                        "enabled": True,
-                        "type": "Lifecycle",
-                        "definition": {
-                            "filters": {
-                                "blobTypes": ["blockBlob"],
-                                "prefixMatch": ["billing-hot/"]
-                            },
-                            "actions": {
-                                "baseBlob": {
-                                    "tierToCool": {
-                                        "daysAfterModificationGreaterThan": 90
-                                    }
-                                }
-                            }
-                        }
-                    }
-                ]
-            }
+            return DEFAULT_LIFECYCLE_POLICY
+    
+    def setup_lifecycle_policy(self):
+        """Apply lifecycle management policy to storage account"""
+        print("📋 Setting up blob lifecycle management policy...")
         
-        # Write policy to temporary file
-        policy_file = 'temp_policy.json'
-        with open(policy_file, 'w') as f:
-            json.dump(policy, f, indent=2)
+        policy = self._lifecycle_policy
         
-        try:
-            cmd = [
-                'az', 'storage', 'account', 'management-policy', 'create',
-                '--account-name', self.storage_account,
-                '--resource-group', self.resource_group,
-                '--policy', f'@{policy_file}'
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                print("✅ Lifecycle policy applied successfully")
-            else:
-                print(f"⚠️  Warning: Failed to apply lifecycle policy: {result.stderr}")
-        finally:
-            # Clean up temporary file
-            if os.path.exists(policy_file):
-                os.remove(policy_file)
+        # az accepts the policy as inline JSON, so it never touches the disk
+        cmd = self._az_group_cmd(
+            'storage', 'account', 'management-policy', 'create',
+            account_name=self.storage_account,
+            policy=_json_dumps(policy)
+        )
+        
+        result = self._run_az(cmd)
+        if result.returncode == 0:
+            print("✅ Lifecycle policy applied successfully")
+        else:
+            print(f"⚠️  Warning: Failed to apply lifecycle policy: {result.stderr}")
         
         return True
     
@@ -226,295 +528,305 @@ class AzureTieredStorageSetup:
         """Retrieve connection strings for created resources"""
         print("🔗 Retrieving connection strings...")
         
+        # The Cosmos DB connection string carries both the endpoint and the key,
+        # so one az call replaces separate show and keys list calls
+        queries = {
+            'cosmos_connection_string': self._az_group_cmd(
+                'cosmosdb', 'keys', 'list',
+                type='connection-strings',
+                name=self.cosmos_account,
+                query="connectionStrings[?description=='Primary SQL Connection String'].connectionString | [0]",
+                output='tsv'
+            ),
+            'storage_connection_string': self._az_group_cmd(
+                'storage', 'account', 'show-connection-string',
+                name=self.storage_account,
+                query='connectionString',
+                output='tsv'
+            )
+        }
+        
+        # The lookups are independent, so every az process is started before waiting on any
         connection_info = {}
-        
-        # Get Cosmos DB connection details
-        try:
-            cmd = [
-                'az', 'cosmosdb', 'show',
-                '--resource-group', self.resource_group,
-                '--name', self.cosmos_account,
-                '--query', 'documentEndpoint',
-                '--output', 'tsv'
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+        processes = {}
+        for name, cmd in queries.items():
+            try:
+                processes[name] = self._spawn(cmd)
+            except OSError as e:
+                print(f"⚠️  Warning: Could not retrieve {name}: {e}")
+        
+        for name, process in processes.items():
+            result = self._wait_az(process)
             if result.returncode == 0:
-                connection_info['cosmos_endpoint'] = result.stdout.strip()
-            
-            cmd = [
-                'az', 'cosmosdb', 'keys', 'list',
-                '--resource-group', self.resource_group,
-                '--name', self.cosmos_account,
-                '--query', 'primaryMasterKey',
-                '--output', 'tsv'
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                connection_info['cosmos_key'] = result.stdout.strip()
+                connection_info[name] = result.stdout.strip()
+            else:
+                print(f"⚠️  Warning: Could not retrieve {name}: {result.stderr}")
+        
+        # AccountEndpoint=https://...;AccountKey=...; (the key's base64 may end in '=')
+        cosmos_connection_string = connection_info.pop('cosmos_connection_string', '')
+        fields = dict(
+            part.split('=', 1) for part in cosmos_connection_string.split(';') if '=' in part
+        )
+        if 'AccountEndpoint' in fields:
+            connection_info['cosmos_endpoint'] = fields['AccountEndpoint']
+        if 'AccountKey' in fields:
+            connection_info['cosmos_key'] = fields['AccountKey']
+        
+        return connection_info
+    
+    def print_summary(self, connection_info):
+        """Print created resources and the environment variables the scripts read"""
+        print("\n" + "="*60)
+        print("SETUP COMPLETE")
+        print("="*60)
+        print(f"Finished at: {datetime.now().isoformat()}")
+        print()
+        print("Created resources:")
+        for resource in self.created_resources:
+            print(f"  - {resource}")
+        print()
+        print("Set these environment variables for the transfer and retrieval scripts:")
+        print(f"  export COSMOS_ENDPOINT=\"{connection_info.get('cosmos_endpoint', '')}\"")
+        print(f"  export COSMOS_KEY=\"{connection_info.get('cosmos_key', '')}\"")
+        print(f"  export AZURE_STORAGE_CONNECTION_STRING=\"{connection_info.get('storage_connection_string', '')}\"")
+        print("="*60)
+    
+    def run(self):
+        """
+        Create all resources. Cosmos DB and the storage account only depend on the
+        resource group, so they are provisioned concurrently
+        Returns: True if every required step succeeded
+        """
+        print("🚀 Starting Azure Tiered Storage setup")
+        
+        if not self.check_prerequisites():
+            return False
         
-        except Exception as e:
-            print(f"⚠️  Warning: Could not retrieve Cosmos DB connection info: {e}")
+        if self.completed_steps:
+            if self._resource_group_exists():
+                print(f"♻️  Resuming the unfinished setup of {self.resource_group}")
+            else:
+                # Cleaned up since; nothing from that run can be reused
+                self.completed_steps.clear()
+                self.created_resources.clear()
         
-        # Get Storage Account"""
-One-click setup script for Azure Tiered Storage
-Creates all necessary Azure resources and configurations
-"""
-
-import os
-import sys
-import json
-import time
-import subprocess
-from datetime import datetime
-
-class AzureTieredStorageSetup:
-    def __init__(self):
-        self.resource_group = f"billing-tiered-storage-{int(time.time())}"
-        self.location = "eastus"
-        self.cosmos_account = f"billing-cosmos-{int(time.time())}"
-        self.storage_account = f"billing{str(int(time.time()))[-8:]}"  # Keep it short
-        self.cosmos_database = "billing-database"
-        self.cosmos_container = "billing-records"
+        if not self._run_step('resource_group', self.create_resource_group):
+            return False
         
-        self.created_resources = []
-    
-    def check_prerequisites(self):
-        """Check if Azure CLI is installed and user is logged in"""
-        print("🔍 Checking prerequisites...")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cosmos = executor.submit(self._run_step, 'cosmos_db', self.create_cosmos_db)
+            storage = executor.submit(
+                lambda: self._run_step('storage_account', self.create_storage_account)
+                and self._run_step('lifecycle_policy', self.setup_lifecycle_policy)
+            )
+            cosmos_ok, storage_ok = cosmos.result(), storage.result()
+        
+        if not (cosmos_ok and storage_ok):
+            print("❌ Setup failed; resources created so far:")
+            for resource in self.created_resources:
+                print(f"  - {resource}")
+            print(f"ℹ️  Run setup again to resume, or delete {SETUP_STATE_FILE} to start over")
+            return False
+        
+        connection_info = self.get_connection_strings()
+        self.print_summary(connection_info)
         
         try:
-            # Check Azure CLI installation
-            result = subprocess.run(['az', '--version'], capture_output=True, text=True)
-            if result.returncode != 0:
-                print("❌ Azure CLI is not installed. Please install it first.")
-                print("   Visit: https://docs.microsoft.com/en-us/cli/azure/install-azure-cli")
-                return False
-            
-            # Check if logged in
-            result = subprocess.run(['az', 'account', 'show'], capture_output=True, text=True)
-            if result.returncode != 0:
-                print("❌ Not logged into Azure. Please run 'az login' first.")
-                return False
-            
-            account_info = json.loads(result.stdout)
-            print(f"✅ Logged into Azure as: {account_info.get('user', {}).get('name', 'Unknown')}")
-            print(f"✅ Subscription: {account_info.get('name', 'Unknown')}")
-            
-            return True
-            
+            os.remove(SETUP_STATE_FILE)
+        except FileNotFoundError:
+            pass
+        return True
+
+class AzureTieredStorageSdkSetup(AzureTieredStorageSetup):
+    """
+    Setup through the Azure management SDKs: every step is an in-process ARM call
+    (authenticated with the az login session) instead of a separate az process
+    """
+    
+    @cached_property
+    def _clients(self):
+        """Management clients for the subscription found by check_prerequisites()"""
+        credential = AzureCliCredential()
+        return {
+            'resource': ResourceManagementClient(credential, self.subscription_id),
+            'cosmos': CosmosDBManagementClient(credential, self.subscription_id),
+            'storage': StorageManagementClient(credential, self.subscription_id)
+        }
+    
+    def _call(self, description, operation):
+        """
+        Run one management operation, reporting a failure like the CLI steps do
+        Returns: the operation's result, or None if it failed
+        """
+        try:
+            return operation()
         except Exception as e:
-            print(f"❌ Error checking prerequisites: {e}")
-            return False
+            print(f"❌ Failed to {description}: {e}")
+            return None
+    
+    def _resource_group_exists(self):
+        """Returns: True if the resource group is still there"""
+        return bool(self._call("check resource group", lambda: self._clients['resource'].resource_groups.check_existence(
+            self.resource_group
+        )))
     
     def create_resource_group(self):
         """Create Azure Resource Group"""
         print(f"📦 Creating resource group: {self.resource_group}")
         
-        cmd = [
-            'az', 'group', 'create',
-            '--name', self.resource_group,
-            '--location', self.location
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"✅ Resource group created successfully")
-            self.created_resources.append(f"Resource Group: {self.resource_group}")
-            return True
-        else:
-            print(f"❌ Failed to create resource group: {result.stderr}")
+        if not self._call("create resource group", lambda: self._clients['resource'].resource_groups.create_or_update(
+            self.resource_group, {'location': self.location}
+        )):
             return False
+        
+        print(f"✅ Resource group created successfully")
+        self._record_resource(f"Resource Group: {self.resource_group}")
+        return True
     
-    def create_cosmos_db(self):
-        """Create Cosmos DB account, database, and container"""
+    def _create_cosmos_account(self):
+        """Create the Cosmos DB account and wait until it is provisioned"""
         print(f"🌌 Creating Cosmos DB account: {self.cosmos_account}")
-        
-        # Create Cosmos DB account
-        cmd = [
-            'az', 'cosmosdb', 'create',
-            '--resource-group', self.resource_group,
-            '--name', self.cosmos_account,
-            '--default-consistency-level', 'Session',
-            '--locations', f'regionName={self.location}',
-            '--enable-automatic-failover'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Failed to create Cosmos DB account: {result.stderr}")
+        cosmos = self._clients['cosmos']
+        
+        # begin_* calls return a poller for the ARM long-running operation
+        if not self._call("create Cosmos DB account", lambda: cosmos.database_accounts.begin_create_or_update(
+            self.resource_group, self.cosmos_account, {
+                'location': self.location,
+                'locations': [{'location_name': self.location, 'failover_priority': 0}],
+                'database_account_offer_type': 'Standard',
+                'consistency_policy': {'default_consistency_level': 'Session'},
+                'enable_automatic_failover': True
+            }
+        ).result()):
             return False
         
         print("✅ Cosmos DB account created")
-        self.created_resources.append(f"Cosmos DB Account: {self.cosmos_account}")
+        self._record_resource(f"Cosmos DB Account: {self.cosmos_account}")
+        return True
+    
+    def create_cosmos_db(self):
+        """Create Cosmos DB account, database, and container"""
+        # The account takes minutes to provision, so a rerun keeps the one it has
+        if not self._run_step('cosmos_account', self._create_cosmos_account):
+            return False
+        cosmos = self._clients['cosmos']
         
-        # Create database
         print(f"📚 Creating database: {self.cosmos_database}")
-        cmd = [
-            'az', 'cosmosdb', 'sql', 'database', 'create',
-            '--resource-group', self.resource_group,
-            '--account-name', self.cosmos_account,
-            '--name', self.cosmos_database
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Failed to create database: {result.stderr}")
+        if not self._call("create database", lambda: cosmos.sql_resources.begin_create_update_sql_database(
+            self.resource_group, self.cosmos_account, self.cosmos_database,
+            {'resource': {'id': self.cosmos_database}, 'options': {}}
+        ).result()):
             return False
         
         print("✅ Database created")
         
-        # Create container
         print(f"📋 Creating container: {self.cosmos_container}")
-        cmd = [
-            'az', 'cosmosdb', 'sql', 'container', 'create',
-            '--resource-group', self.resource_group,
-            '--account-name', self.cosmos_account,
-            '--database-name', self.cosmos_database,
-            '--name', self.cosmos_container,
-            '--partition-key-path', '/id',
-            '--throughput', '400'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Failed to create container: {result.stderr}")
+        resource = {
+            'id': self.cosmos_container,
+            'partitionKey': {'paths': ['/id'], 'kind': 'Hash'}
+        }
+        # Indexing policy with the composite index used for per-customer lookups
+        if os.path.exists('Cosmos_Indexing_Policy.json'):
+            with open('Cosmos_Indexing_Policy.json', 'r') as f:
+                resource['indexingPolicy'] = _json_loads(f.read())
+        
+        if not self._call("create container", lambda: cosmos.sql_resources.begin_create_update_sql_container(
+            self.resource_group, self.cosmos_account, self.cosmos_database, self.cosmos_container,
+            {'resource': resource, 'options': {'throughput': 400}}
+        ).result()):
             return False
         
         print("✅ Container created")
         return True
     
-    def create_storage_account(self):
-        """Create Storage Account with Hot and Cool tiers"""
+    def create_storage_account(self, containers=BLOB_CONTAINERS):
+        """Create Storage Account with Hot and Cool tiers and its blob containers"""
         print(f"💾 Creating storage account: {self.storage_account}")
-        
-        cmd = [
-            'az', 'storage', 'account', 'create',
-            '--resource-group', self.resource_group,
-            '--name', self.storage_account,
-            '--location', self.location,
-            '--sku', 'Standard_LRS',
-            '--access-tier', 'Hot',
-            '--kind', 'StorageV2'
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"❌ Failed to create storage account: {result.stderr}")
+        storage = self._clients['storage']
+        
+        if not self._call("create storage account", lambda: storage.storage_accounts.begin_create(
+            self.resource_group, self.storage_account, {
+                'location': self.location,
+                'sku': {'name': 'Standard_LRS'},
+                'kind': 'StorageV2',
+                'access_tier': 'Hot'
+            }
+        ).result()):
             return False
         
         print("✅ Storage account created")
-        self.created_resources.append(f"Storage Account: {self.storage_account}")
+        self._record_resource(f"Storage Account: {self.storage_account}")
         
-        # Create blob containers
-        containers = ['billing-hot', 'billing-cold']
-        
-        for container in containers:
+        def create_container(container):
             print(f"📦 Creating blob container: {container}")
-            cmd = [
-                'az', 'storage', 'container', 'create',
-                '--name', container,
-                '--account-name', self.storage_account,
-                '--public-access', 'off'
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                print(f"❌ Failed to create container {container}: {result.stderr}")
+            if not self._call(f"create container {container}", lambda: storage.blob_containers.create(
+                self.resource_group, self.storage_account, container, {'public_access': 'None'}
+            )):
                 return False
-            
             print(f"✅ Container {container} created")
+            return True
         
-        return True
+        # The containers are independent and share the client's connection pool
+        with ThreadPoolExecutor(max_workers=len(containers)) as executor:
+            results = list(executor.map(create_container, containers))
+        
+        return all(results)
     
     def setup_lifecycle_policy(self):
         """Apply lifecycle management policy to storage account"""
         print("📋 Setting up blob lifecycle management policy...")
         
-        # Read the policy file
-        try:
-            with open('Blob_Storage_Policy.json', 'r') as f:
-                policy = json.load(f)
-        except FileNotFoundError:
-            print("⚠️  Blob_Storage_Policy.json not found, creating default policy...")
-            policy = {
-                "rules": [
-                    {
-                        "name": "MoveHotToColdAfter90Days",
-                        "enabled": True,
-                        "type": "Lifecycle",
-                        "definition": {
-                            "filters": {
-                                "blobTypes": ["blockBlob"],
-                                "prefixMatch": ["billing-hot/"]
-                            },
-                            "actions": {
-                                "baseBlob": {
-                                    "tierToCool": {
-                                        "daysAfterModificationGreaterThan": 90
-                                    }
-                                }
-                            }
-                        }
-                    }
-                ]
-            }
-        
-        # Write policy to temporary file
-        policy_file = 'temp_policy.json'
-        with open(policy_file, 'w') as f:
-            json.dump(policy, f, indent=2)
-        
+        policy = self._lifecycle_policy
         try:
-            cmd = [
-                'az', 'storage', 'account', 'management-policy', 'create',
-                '--account-name', self.storage_account,
-                '--resource-group', self.resource_group,
-                '--policy', f'@{policy_file}'
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                print("✅ Lifecycle policy applied successfully")
-            else:
-                print(f"⚠️  Warning: Failed to apply lifecycle policy: {result.stderr}")
-        finally:
-            # Clean up temporary file
-            if os.path.exists(policy_file):
-                os.remove(policy_file)
+            self._clients['storage'].management_policies.create_or_update(
+                self.resource_group, self.storage_account, 'default', {'policy': policy}
+            )
+            print("✅ Lifecycle policy applied successfully")
+        except Exception as e:
+            print(f"⚠️  Warning: Failed to apply lifecycle policy: {e}")
         
         return True
     
     def get_connection_strings(self):
         """Retrieve connection strings for created resources"""
         print("🔗 Retrieving connection strings...")
-        
+        cosmos = self._clients['cosmos']
+        storage = self._clients['storage']
+        
+        def storage_connection_string():
+            key = storage.storage_accounts.list_keys(self.resource_group, self.storage_account).keys[0].value
+            return (
+                f"DefaultEndpointsProtocol=https;AccountName={self.storage_account};"
+                f"AccountKey={key};EndpointSuffix=core.windows.net"
+            )
+        
+        lookups = {
+            'cosmos_endpoint': lambda: cosmos.database_accounts.get(
+                self.resource_group, self.cosmos_account
+            ).document_endpoint,
+            'cosmos_key': lambda: cosmos.database_accounts.list_keys(
+                self.resource_group, self.cosmos_account
+            ).primary_master_key,
+            'storage_connection_string': storage_connection_string
+        }
+        
+        # The lookups are independent, so they all run at once
         connection_info = {}
-        
-        # Get Cosmos DB connection details
-        try:
-            cmd = [
-                'az', 'cosmosdb', 'show',
-                '--resource-group', self.resource_group,
-                '--name', self.cosmos_account,
-                '--query', 'documentEndpoint',
-                '--output', 'tsv'
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                connection_info['cosmos_endpoint'] = result.stdout.strip()
-            
-            cmd = [
-                'az', 'cosmosdb', 'keys', 'list',
-                '--resource-group', self.resource_group,
-                '--name', self.cosmos_account,
-                '--query', 'primaryMasterKey',
-                '--output', 'tsv'
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                connection_info['cosmos_key'] = result.stdout.strip()
-        
-        except Exception as e:
-            print(f"⚠️  Warning: Could not retrieve Cosmos DB connection info: {e}")
-        
-        # Get Storage Account
+        with ThreadPoolExecutor(max_workers=len(lookups)) as executor:
+            futures = {name: executor.submit(lookup) for name, lookup in lookups.items()}
+            for name, future in futures.items():
+                try:
+                    connection_info[name] = future.result()
+                except Exception as e:
+                    print(f"⚠️  Warning: Could not retrieve {name}: {e}")
+        
+        return connection_info
+
+def main():
+    """Main execution function"""
+    setup = AzureTieredStorageSdkSetup() if AzureCliCredential else AzureTieredStorageSetup()
+    if not setup.run():
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import asyncio
+import gzip
+import json
+import re
+import time
+import unittest
+
+try:
+    import Retrieval
+    from Retrieval import AsyncTieredRetrieval, TieredRetrieval
+except ImportError as e:
+    raise unittest.SkipTest(f"Retrieval dependencies not installed: {e}")
+
+def _project(query, document):
+    """Apply a query's SELECT list to a document, the way Cosmos DB would"""
+    columns = re.search(r'SELECT\s+(?:TOP\s+@\w+\s+)?(.*?)\s+FROM', query, re.S).group(1)
+    if columns.strip() == '*':
+        return dict(document)
+    fields = re.findall(r'c\.(\w+)', columns)
+    return {field: document[field] for field in fields if field in document}
+
+def _bundle(records):
+    """
+    Build a bundle blob the way the transfer script does: one gzip member per record
+    Returns: (blob bytes, [(offset, length)] per record)
+    """
+    blob, ranges = b'', []
+    for record in records:
+        member = gzip.compress(json.dumps(record).encode('utf-8') + b'\n')
+        ranges.append((len(blob), len(member)))
+        blob += member
+    return blob, ranges
+
+class _FakeDownload:
+    def __init__(self, data):
+        self.data = data
+    
+    def readall(self):
+        return self.data
+
+class _FakeBlobContainer:
+    """Blob container client serving byte ranges of in-memory blobs"""
+    
+    def __init__(self, name, blobs):
+        self.container_name = name
+        self.blobs = blobs
+    
+    def download_blob(self, blob_path, offset=None, length=None, **kwargs):
+        data = self.blobs[blob_path]
+        if offset is not None and length:
+            data = data[offset:offset + length]
+        return _FakeDownload(data)
+
+class _FakeQuery:
+    def __init__(self, items, page_size):
+        self.items = items
+        self.page_size = page_size
+    
+    def __iter__(self):
+        return iter(self.items)
+    
+    def by_page(self):
+        return (
+            self.items[i:i + self.page_size]
+            for i in range(0, len(self.items), self.page_size)
+        )
+
+class _FakeCosmosContainer:
+    """Cosmos DB container answering the customer and ID-list queries from a dict"""
+    
+    def __init__(self, documents):
+        self.documents = documents
+        self.queries = []
+    
+    def _answer(self, query, parameters):
+        self.queries.append(query)
+        values = {p['name']: p['value'] for p in parameters}
+        if '@ids' in values:
+            return [dict(self.documents[i]) for i in values['@ids'] if i in self.documents]
+        
+        matching = sorted(
+            (d for d in self.documents.values() if d.get('customerId') == values['@customer_id']),
+            key=lambda d: d['createdAt'], reverse=True
+        )
+        return [_project(query, d) for d in matching[:values['@limit']]]
+    
+    def query_items(self, query, parameters=(), max_item_count=100, **kwargs):
+        return _FakeQuery(self._answer(query, parameters), max_item_count)
+
+class _AsyncIterable:
+    def __init__(self, items):
+        self.items = items
+    
+    async def __aiter__(self):
+        for item in self.items:
+            yield item
+
+class _FakeAsyncDownload(_FakeDownload):
+    async def readall(self):
+        return self.data
+
+class _FakeAsyncBlobContainer(_FakeBlobContainer):
+    async def download_blob(self, blob_path, offset=None, length=None, **kwargs):
+        return _FakeAsyncDownload(super().download_blob(blob_path, offset, length).data)
+
+class _FakeAsyncQuery(_AsyncIterable):
+    def __init__(self, items, page_size):
+        super().__init__(items)
+        self.page_size = page_size
+    
+    def by_page(self):
+        return _AsyncIterable([
+            _AsyncIterable(self.items[i:i + self.page_size])
+            for i in range(0, len(self.items), self.page_size)
+        ])
+
+class _FakeAsyncCosmosContainer(_FakeCosmosContainer):
+    def query_items(self, query, parameters=(), max_item_count=100, **kwargs):
+        return _FakeAsyncQuery(self._answer(query, parameters), max_item_count)
+
+class _FailingAsyncQuery(_FakeAsyncQuery):
+    """Query whose second page fails to arrive, after the first page's downloads have started"""
+    
+    def by_page(self):
+        async def pages():
+            yield _AsyncIterable(self.items[:self.page_size])
+            raise Exception("service unavailable")
+        return pages()
+
+class _FailingAsyncCosmosContainer(_FakeCosmosContainer):
+    def query_items(self, query, parameters=(), max_item_count=100, **kwargs):
+        return _FailingAsyncQuery(self._answer(query, parameters), 3)
+
+class _SlowAsyncBlobContainer(_FakeAsyncBlobContainer):
+    async def download_blob(self, *args, **kwargs):
+        await asyncio.sleep(10)
+
+class CustomerRecordsTest(unittest.TestCase):
+    """
+    get_records_by_customer returns Tier 1 records from the customer query itself and
+    reads Tier 2/3 records out of multi-record bundle blobs
+    """
+    
+    def setUp(self):
+        records = [
+            {'id': f'rec-{n}', 'customerId': 'cust-1', 'createdAt': f'2024-01-0{n}T00:00:00', 'amount': n}
+            for n in range(1, 7)
+        ]
+        self.expected = {record['id']: record for record in records}
+        
+        hot_blob, hot_ranges = _bundle(records[:3])
+        cold_blob, cold_ranges = _bundle(records[3:])
+        self.blobs = {
+            'billing-hot': {'cust-1/run-000001.ndjson.gz': hot_blob},
+            'billing-cold': {'cust-1/run-000002.ndjson.gz': cold_blob}
+        }
+        
+        # Cosmos DB keeps Tier 1 records whole and only the pointer fields of migrated ones
+        tier1_record = {'id': 'rec-7', 'customerId': 'cust-1', 'createdAt': '2024-01-07T00:00:00', 'amount': 7}
+        self.expected[tier1_record['id']] = tier1_record
+        self.documents = {tier1_record['id']: dict(tier1_record)}
+        for record, (offset, length) in zip(records[:3], hot_ranges):
+            self.documents[record['id']] = self._pointer(record, 'hot_blob', 'cust-1/run-000001.ndjson.gz', offset, length)
+        for record, (offset, length) in zip(records[3:], cold_ranges):
+            self.documents[record['id']] = self._pointer(record, 'cold_blob', 'cust-1/run-000002.ndjson.gz', offset, length)
+    
+    @staticmethod
+    def _pointer(record, storage_tier, blob_path, offset, length):
+        return {
+            'id': record['id'],
+            'customerId': record['customerId'],
+            'createdAt': record['createdAt'],
+            'storage_tier': storage_tier,
+            'blob_path': blob_path,
+            'blob_offset': offset,
+            'blob_length': length
+        }
+    
+    def _assert_all_found(self, results, container):
+        self.assertEqual([r['record_id'] for r in results], [f'rec-{n}' for n in range(7, 0, -1)])
+        for result in results:
+            self.assertEqual(result['record'], self.expected[result['record_id']])
+        self.assertEqual(
+            sorted(r['source'] for r in results),
+            ['tier1-cosmos'] + ['tier2-hot'] * 3 + ['tier3-cold'] * 3
+        )
+        # No follow-up read for the Tier 1 documents
+        self.assertEqual(len(container.queries), 1)
+    
+    def test_sync(self):
+        retrieval = TieredRetrieval.__new__(TieredRetrieval)
+        retrieval.container = _FakeCosmosContainer(self.documents)
+        retrieval._hot_container_client = _FakeBlobContainer('billing-hot', self.blobs['billing-hot'])
+        retrieval._cold_container_client = _FakeBlobContainer('billing-cold', self.blobs['billing-cold'])
+        retrieval._redis = None
+        retrieval._init_local_state()
+        
+        self._assert_all_found(retrieval.get_records_by_customer('cust-1', limit=10), retrieval.container)
+    
+    def test_async(self):
+        retrieval = AsyncTieredRetrieval.__new__(AsyncTieredRetrieval)
+        retrieval.container = _FakeAsyncCosmosContainer(self.documents)
+        retrieval._hot_container_client = _FakeAsyncBlobContainer('billing-hot', self.blobs['billing-hot'])
+        retrieval._cold_container_client = _FakeAsyncBlobContainer('billing-cold', self.blobs['billing-cold'])
+        retrieval._redis = None
+        retrieval._http_session = None
+        retrieval._init_local_state()
+        
+        self._assert_all_found(
+            asyncio.run(retrieval.get_records_by_customer('cust-1', limit=10)), retrieval.container
+        )
+    
+    def test_async_query_failure(self):
+        retrieval = AsyncTieredRetrieval.__new__(AsyncTieredRetrieval)
+        retrieval.container = _FailingAsyncCosmosContainer(self.documents)
+        retrieval._hot_container_client = _SlowAsyncBlobContainer('billing-hot', self.blobs['billing-hot'])
+        retrieval._cold_container_client = _SlowAsyncBlobContainer('billing-cold', self.blobs['billing-cold'])
+        retrieval._redis = None
+        retrieval._http_session = None
+        retrieval._init_local_state()
+        
+        async def run():
+            results = await retrieval.get_records_by_customer('cust-1', limit=10)
+            return results, [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        
+        self.assertEqual(asyncio.run(run()), ([], []))
+
+class _UnavailableRedis:
+    """Redis client whose every call fails as if the server were down"""
+    
+    def delete(self, key):
+        raise Retrieval.redis.RedisError("connection refused")
+
+class _UnavailableAsyncRedis:
+    async def delete(self, key):
+        raise Retrieval.redis.RedisError("connection refused")
+
+@unittest.skipIf(Retrieval.redis is None, "redis not installed")
+class InvalidateTest(unittest.TestCase):
+    """invalidate() clears the in-process caches even when Redis is unavailable"""
+    
+    def test_sync(self):
+        retrieval = TieredRetrieval.__new__(TieredRetrieval)
+        retrieval._redis = _UnavailableRedis()
+        retrieval._init_local_state()
+        retrieval._record_cache.put('rec-1', {'id': 'rec-1'})
+        
+        with self.assertLogs(Retrieval.logger, 'WARNING'):
+            retrieval.invalidate('rec-1')
+        self.assertIsNone(retrieval._record_cache.get('rec-1'))
+    
+    def test_async(self):
+        retrieval = AsyncTieredRetrieval.__new__(AsyncTieredRetrieval)
+        retrieval._redis = _UnavailableAsyncRedis()
+        retrieval._init_local_state()
+        retrieval._record_cache.put('rec-1', {'id': 'rec-1'})
+        
+        with self.assertLogs(Retrieval.logger, 'WARNING'):
+            asyncio.run(retrieval.invalidate('rec-1'))
+        self.assertIsNone(retrieval._record_cache.get('rec-1'))
+
+class _FakeRedis:
+    def __init__(self, values):
+        self.values = values
+    
+    def get(self, key):
+        return self.values.get(key)
+
+@unittest.skipIf(Retrieval.redis is None, "redis not installed")
+class SharedRecordTest(unittest.TestCase):
+    """A Redis value that does not decode is a miss, not an error"""
+    
+    def _lookup(self, raw):
+        retrieval = TieredRetrieval.__new__(TieredRetrieval)
+        retrieval._redis = _FakeRedis({'record:rec-1': raw})
+        retrieval._init_local_state()
+        return retrieval._get_shared_record('rec-1', time.perf_counter_ns())
+    
+    def test_hit(self):
+        record, source, _ = self._lookup(b'{"id": "rec-1"}')
+        self.assertEqual((record, source), ({'id': 'rec-1'}, 'redis'))
+    
+    def test_unreadable_value_is_a_miss(self):
+        with self.assertLogs(Retrieval.logger, 'WARNING'):
+            self.assertIsNone(self._lookup(b'{"id": "re'))
+
+if __name__ == '__main__':
+    unittest.main()
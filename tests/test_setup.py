@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import setup
+
+class RunStepTest(unittest.TestCase):
+    """Completed steps are saved to SETUP_STATE_FILE and skipped by a rerun"""
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_file = os.path.join(directory.name, 'state.json')
+        patcher = mock.patch.object(setup, 'SETUP_STATE_FILE', self.state_file)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_completed_step_is_skipped_on_rerun(self):
+        first = setup.AzureTieredStorageSetup()
+        operation = mock.Mock(return_value=True)
+        self.assertTrue(first._run_step('resource_group', operation))
+        operation.assert_called_once_with()
+        
+        rerun = setup.AzureTieredStorageSetup()
+        self.assertEqual(rerun.timestamp, first.timestamp)
+        self.assertEqual(rerun.resource_group, first.resource_group)
+        
+        operation.reset_mock()
+        self.assertTrue(rerun._run_step('resource_group', operation))
+        operation.assert_not_called()
+    
+    def test_failed_step_is_run_again(self):
+        first = setup.AzureTieredStorageSetup()
+        first._run_step('resource_group', lambda: True)
+        self.assertFalse(first._run_step('cosmos_db', lambda: False))
+        
+        rerun = setup.AzureTieredStorageSetup()
+        self.assertEqual(rerun.completed_steps, {'resource_group'})
+        
+        operation = mock.Mock(return_value=True)
+        self.assertTrue(rerun._run_step('cosmos_db', operation))
+        operation.assert_called_once_with()
+    
+    def test_state_is_replaced_whole(self):
+        first = setup.AzureTieredStorageSetup()
+        first._record_resource(f"Resource Group: {first.resource_group}")
+        first._run_step('resource_group', lambda: True)
+        
+        self.assertFalse(os.path.exists(f"{self.state_file}.tmp"))
+        self.assertEqual(
+            setup.AzureTieredStorageSetup._load_state(),
+            {
+                'timestamp': first.timestamp,
+                'completed_steps': ['resource_group'],
+                'created_resources': [f"Resource Group: {first.resource_group}"]
+            }
+        )
+    
+    def test_resources_are_listed_once_after_resume(self):
+        first = setup.AzureTieredStorageSetup()
+        first._record_resource(f"Resource Group: {first.resource_group}")
+        first._run_step('resource_group', lambda: True)
+        
+        rerun = setup.AzureTieredStorageSetup()
+        rerun._record_resource(f"Resource Group: {rerun.resource_group}")
+        rerun._record_resource(f"Cosmos DB Account: {rerun.cosmos_account}")
+        self.assertEqual(
+            rerun.created_resources,
+            [f"Resource Group: {first.resource_group}", f"Cosmos DB Account: {first.cosmos_account}"]
+        )
+    
+    def test_unreadable_state_starts_over(self):
+        with open(self.state_file, 'w') as f:
+            f.write('{"timestamp": ')
+        
+        self.assertEqual(setup.AzureTieredStorageSetup._load_state(), {})
+        self.assertEqual(setup.AzureTieredStorageSetup().completed_steps, set())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,369 @@
+import asyncio
+import gzip
+import importlib.util
+import itertools
+import json
+import os
+import time
+import unittest
+from collections import Counter
+from unittest import mock
+
+try:
+    _spec = importlib.util.spec_from_file_location(
+        'transfer',
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Transfer_data_from_cosmo-db_to_blob-storage.py')
+    )
+    transfer = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(transfer)
+except ImportError as e:
+    raise unittest.SkipTest(f"Transfer dependencies not installed: {e}")
+
+class _FakeProperties:
+    def __init__(self, size):
+        self.size = size
+        self.metadata = {}
+        self.content_settings = None
+
+class _FakeDownload:
+    def __init__(self, data):
+        self.data = data
+    
+    async def readall(self):
+        return self.data
+
+class _FakeBlob:
+    """Blob client over a {(container, path): bytes} dict shared by all containers"""
+    
+    def __init__(self, store, container, path):
+        self.store = store
+        self.key = (container, path)
+        self.url = f"https://account.blob.core.windows.net/{container}/{path}"
+    
+    async def upload_blob(self, data, **kwargs):
+        self.store[self.key] = bytes(data)
+    
+    async def download_blob(self, **kwargs):
+        return _FakeDownload(self.store[self.key])
+    
+    async def get_blob_properties(self):
+        return _FakeProperties(len(self.store[self.key]))
+    
+    async def start_copy_from_url(self, url, **kwargs):
+        container, path = url.split('.net/', 1)[1].split('/', 1)
+        self.store[self.key] = self.store[(container, path)]
+        return {'copy_status': 'success'}
+    
+    async def delete_blob(self, **kwargs):
+        del self.store[self.key]
+
+class _FakeBlobContainer:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+    
+    def get_blob_client(self, path):
+        return _FakeBlob(self.store, self.name, path)
+    
+    async def create_container(self, **kwargs):
+        self.store[(self.name, None)] = b''
+
+class _FakeCosmosContainer:
+    """Cosmos DB container recording writes; items whose id is in fail_ids are rejected"""
+    
+    def __init__(self, fail_ids=(), status_code=412):
+        self.fail_ids = set(fail_ids)
+        self.status_code = status_code
+        self.calls = []
+    
+    def _check(self, *ids):
+        if self.fail_ids.intersection(ids):
+            error = Exception("precondition failed")
+            error.status_code = self.status_code
+            raise error
+    
+    async def replace_item(self, item_id, body, **kwargs):
+        self.calls.append(('replace', item_id, kwargs))
+        self._check(item_id)
+    
+    async def patch_item(self, item_id, partition_key, patch_operations, **kwargs):
+        self.calls.append(('patch', item_id, patch_operations, kwargs))
+        self._check(item_id)
+    
+    async def execute_item_batch(self, batch_operations, partition_key):
+        self.calls.append(('batch', partition_key, batch_operations))
+        self._check(*(args[0] for _, args, _ in batch_operations))
+    
+    async def upsert_item(self, body, **kwargs):
+        self.calls.append(('upsert', body))
+    
+    async def query_items(self, query, **kwargs):
+        for row in ({'storage_tier': None, 'record_count': 2}, {'storage_tier': 'hot_blob', 'record_count': 3}):
+            yield row
+
+def _transfer(partition_key_path='/id', fail_ids=(), status_code=412):
+    """A TieredDataTransfer on fake clients, built without connecting anywhere"""
+    t = transfer.TieredDataTransfer.__new__(transfer.TieredDataTransfer)
+    t.partition_key_path = partition_key_path
+    t.container = _FakeCosmosContainer(fail_ids, status_code)
+    t._cooldown_until = {}
+    t.blob_store = {}
+    t.hot_container = 'billing-hot'
+    t.cold_container = 'billing-cold'
+    t._container_clients = {
+        name: _FakeBlobContainer(t.blob_store, name) for name in (t.hot_container, t.cold_container)
+    }
+    t.blob_max_concurrency = 1
+    t.blob_sas_ttl_days = 0
+    t.blob_gzip_level = 6
+    t.run_id = 'run'
+    t._bundle_sequence = itertools.count()
+    t._stamp_migration()
+    t._cold_copies = {}
+    t._hot_blob_records = Counter()
+    t._hot_blob_moved = Counter()
+    t.migration_concurrency = 4
+    t.stats = {
+        'tier1_to_tier2': {'success': 0, 'failed': 0, 'errors': []},
+        'tier2_to_tier3': {'success': 0, 'failed': 0, 'errors': []},
+        'total_size_migrated': 0
+    }
+    return t
+
+def _record(record_id, customer_id='cust-1', day=1):
+    return {
+        'id': record_id,
+        'customerId': customer_id,
+        'createdAt': f'2024-01-{day:02d}T12:00:00',
+        'amount': 10,
+        'lines': ['a', 'b'],
+        '_etag': f'etag-{record_id}'
+    }
+
+async def _migrate_page(t, migrate_one, items, stats_key, write_blobs=None):
+    """Run one page through migrate_one and _commit_page, as _migrate_items does"""
+    copies = [(item, asyncio.create_task(migrate_one(item))) for item in items]
+    await t._commit_page(copies, stats_key, 'Tier', write_blobs)
+
+class CommitPageTest(unittest.TestCase):
+    """Tier 1 -> 2 packs a page into per-customer, per-day bundles of gzip members"""
+    
+    def test_bundles_and_byte_ranges(self):
+        t = _transfer()
+        items = [_record('a'), _record('b'), _record('c', 'cust-2'), _record('d', day=2)]
+        originals = {item['id']: dict(item) for item in items}
+        
+        asyncio.run(_migrate_page(t, t._pack_one_t1_t2, items, 'tier1_to_tier2', t._upload_hot_bundles))
+        
+        self.assertEqual(t.stats['tier1_to_tier2']['success'], 4)
+        self.assertEqual(
+            sorted(path for _, path in t.blob_store),
+            ['hot/2024/01/01/cust-1/run-000000.ndjson.gz',
+             'hot/2024/01/01/cust-2/run-000001.ndjson.gz',
+             'hot/2024/01/02/cust-1/run-000002.ndjson.gz']
+        )
+        self.assertEqual(items[0]['blob_path'], items[1]['blob_path'])
+        
+        for item in items:
+            blob = t.blob_store[(t.hot_container, item['blob_path'])]
+            member = blob[item['blob_offset']:item['blob_offset'] + item['blob_length']]
+            self.assertEqual(json.loads(gzip.decompress(member)), originals[item['id']])
+        
+        # The concatenated members are one valid gzip file of NDJSON lines
+        bundle = t.blob_store[(t.hot_container, items[0]['blob_path'])]
+        self.assertEqual([json.loads(line)['id'] for line in gzip.decompress(bundle).splitlines()], ['a', 'b'])
+        
+        # Cosmos DB keeps only the pointer document
+        self.assertNotIn('amount', items[0])
+        self.assertEqual(items[0]['storage_tier'], 'hot_blob')
+    
+    def test_bundle_with_no_written_record_is_deleted(self):
+        t = _transfer(fail_ids={'a', 'b', 'c'})
+        items = [_record('a'), _record('b'), _record('c', 'cust-2'), _record('d', 'cust-2')]
+        
+        with self.assertLogs(transfer.logger, 'WARNING'):
+            asyncio.run(_migrate_page(t, t._pack_one_t1_t2, items, 'tier1_to_tier2', t._upload_hot_bundles))
+        
+        self.assertEqual(t.stats['tier1_to_tier2']['failed'], 3)
+        # cust-1's bundle is referenced by nothing; cust-2's still holds record d
+        self.assertEqual([path for _, path in t.blob_store], ['hot/2024/01/01/cust-2/run-000001.ndjson.gz'])
+
+class WriteItemsTest(unittest.TestCase):
+    """_write_items replaces or patches items, conditioned on their _etag"""
+    
+    def test_replace(self):
+        t = _transfer()
+        errors = asyncio.run(t._write_items([_record('a')]))
+        
+        self.assertEqual(errors, {})
+        (op, item_id, kwargs), = t.container.calls
+        self.assertEqual((op, item_id, kwargs['etag']), ('replace', 'a', 'etag-a'))
+        self.assertEqual(kwargs['match_condition'], transfer.MatchConditions.IfNotModified)
+    
+    def test_patch(self):
+        t = _transfer()
+        item = dict(_record('a'), storage_tier='cold_blob')
+        asyncio.run(t._write_items([item], ('storage_tier',)))
+        
+        (op, item_id, operations, kwargs), = t.container.calls
+        self.assertEqual((op, item_id, kwargs['etag']), ('patch', 'a', 'etag-a'))
+        self.assertEqual(operations, [{'op': 'set', 'path': '/storage_tier', 'value': 'cold_blob'}])
+    
+    def test_batch_per_partition_key(self):
+        t = _transfer('/customerId')
+        items = [_record('a'), _record('b'), _record('c', 'cust-2')]
+        asyncio.run(t._write_items(items, ('storage_tier',)))
+        
+        batch = next(call for call in t.container.calls if call[0] == 'batch')
+        self.assertEqual(batch[1], 'cust-1')
+        self.assertEqual(
+            [(op, args[0], kwargs) for op, args, kwargs in batch[2]],
+            [('patch', 'a', {'if_match_etag': 'etag-a'}), ('patch', 'b', {'if_match_etag': 'etag-b'})]
+        )
+        self.assertIn(('patch', 'c'), [call[:2] for call in t.container.calls])
+    
+    def test_failed_batch_fails_every_item(self):
+        t = _transfer('/customerId', fail_ids={'a'})
+        errors = asyncio.run(t._write_items([_record('a'), _record('b')]))
+        
+        self.assertEqual(sorted(errors), ['a', 'b'])
+        self.assertEqual(t._cooldown_until, {})
+
+class StripPayloadTest(unittest.TestCase):
+    def test_keeps_pointer_partition_key_and_etag(self):
+        t = _transfer('/tenant/region')
+        item = dict(_record('a'), tenant={'region': 'eu'}, storage_tier='hot_blob', blob_path='p')
+        t._strip_payload(item)
+        
+        self.assertEqual(
+            sorted(item),
+            ['_etag', 'blob_path', 'createdAt', 'customerId', 'id', 'storage_tier', 'tenant']
+        )
+
+class MigrateTier2To3Test(unittest.TestCase):
+    """Tier 2 -> 3 copies each hot bundle once and deletes it once all its records moved"""
+    
+    def _hot_items(self, t):
+        t.blob_store[(t.hot_container, 'hot/b1.ndjson.gz')] = b'bundle-1'
+        t.blob_store[(t.hot_container, 'hot/b2.ndjson.gz')] = b'bundle-2'
+        return [
+            {'id': record_id, '_etag': 'e', 'blob_path': path, 'blob_length': 4}
+            for record_id, path in (('a', 'hot/b1.ndjson.gz'), ('b', 'hot/b1.ndjson.gz'), ('c', 'hot/b2.ndjson.gz'))
+        ]
+    
+    async def _migrate(self, t, items):
+        await _migrate_page(t, t._migrate_one_t2_t3, items, 'tier2_to_tier3')
+        await t._delete_moved_hot_blobs()
+    
+    def test_moved_bundles_are_deleted(self):
+        t = _transfer()
+        items = self._hot_items(t)
+        asyncio.run(self._migrate(t, items))
+        
+        self.assertEqual(sorted(t.blob_store), [('billing-cold', 'cold/b1.ndjson.gz'), ('billing-cold', 'cold/b2.ndjson.gz')])
+        self.assertEqual(items[0]['blob_path'], 'cold/b1.ndjson.gz')
+        self.assertEqual(items[0]['storage_tier'], 'cold_blob')
+        self.assertEqual(t.stats['tier2_to_tier3']['success'], 3)
+    
+    def test_hot_bundle_kept_when_a_record_fails(self):
+        t = _transfer(fail_ids={'b'})
+        asyncio.run(self._migrate(t, self._hot_items(t)))
+        
+        self.assertIn((t.hot_container, 'hot/b1.ndjson.gz'), t.blob_store)
+        self.assertNotIn((t.hot_container, 'hot/b2.ndjson.gz'), t.blob_store)
+        self.assertEqual(t.stats['tier2_to_tier3']['failed'], 1)
+
+class _UnlistableBlobService:
+    """Blob service client whose credential may not list containers"""
+    
+    def list_containers(self, **kwargs):
+        raise Exception("AuthorizationPermissionMismatch")
+
+class CreateContainersTest(unittest.TestCase):
+    def test_creates_each_container_when_listing_fails(self):
+        t = _transfer()
+        t.blob_client = _UnlistableBlobService()
+        
+        with self.assertLogs(transfer.logger, 'WARNING'):
+            asyncio.run(t._create_containers())
+        self.assertEqual(sorted(t.blob_store), [('billing-cold', None), ('billing-hot', None)])
+
+class TierCountersTest(unittest.TestCase):
+    """The counters document carries its partition key, read back by Retrieval"""
+    
+    def _refresh(self, partition_key_path):
+        t = _transfer(partition_key_path)
+        asyncio.run(t.refresh_tier_counters())
+        (op, counters), = t.container.calls
+        self.assertEqual(counters['tiers'], {'cosmos': 2, 'hot_blob': 3})
+        return counters
+    
+    def test_id_partition_key(self):
+        self.assertEqual(self._refresh('/id')['id'], transfer.TIER_COUNTERS_ID)
+    
+    def test_shared_partition_key(self):
+        self.assertEqual(self._refresh('/customerId')['customerId'], transfer.TIER_COUNTERS_ID)
+        self.assertEqual(self._refresh('/tenant/region')['tenant'], {'region': transfer.TIER_COUNTERS_ID})
+
+class _AsyncPage:
+    def __init__(self, items):
+        self.items = items
+    
+    async def __aiter__(self):
+        for item in self.items:
+            yield item
+
+class MigrateItemsTest(unittest.TestCase):
+    """_migrate_items leaves no query task behind when it is stopped partway"""
+    
+    def test_cancelled_with_full_queue(self):
+        t = _transfer()
+        
+        async def pages():
+            for n in itertools.count():
+                yield _AsyncPage([{'id': f'rec-{n}'}])
+        
+        async def slow_commit(copies, *args):
+            await asyncio.gather(*(task for _, task in copies))
+            await asyncio.sleep(0.05)
+        t._commit_page = slow_commit
+        
+        async def run():
+            # One page in flight, so the query fills the queue and waits on it
+            with mock.patch.object(transfer, 'MIGRATION_PAGES_IN_FLIGHT', 1):
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(t._migrate_items(pages(), t._pack_one_t1_t2, 'tier1_to_tier2', 'Tier 2'), 0.02)
+            return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        
+        self.assertEqual(asyncio.run(run()), [])
+
+class CooldownTest(unittest.TestCase):
+    """Throttled writes hold back new records of the same partition"""
+    
+    def test_throttled_write_starts_cooldown(self):
+        t = _transfer('/customerId', fail_ids={'a'}, status_code=429)
+        with self.assertLogs(transfer.logger, 'WARNING'):
+            asyncio.run(t._write_items([_record('a')]))
+        self.assertGreater(t._cooldown_until['cust-1'], time.monotonic())
+    
+    def test_waits_only_for_its_own_partition(self):
+        t = _transfer('/customerId')
+        t._cooldown_until['cust-1'] = time.monotonic() + 0.2
+        
+        start = time.monotonic()
+        asyncio.run(t._wait_for_cooldown(_record('b', 'cust-2')))
+        self.assertLess(time.monotonic() - start, 0.1)
+        
+        asyncio.run(t._wait_for_cooldown(_record('a')))
+        self.assertGreaterEqual(time.monotonic(), t._cooldown_until['cust-1'])
+    
+    def test_expired_cooldown_does_not_wait(self):
+        t = _transfer()
+        t._cooldown_until[None] = time.monotonic() - 1
+        
+        start = time.monotonic()
+        asyncio.run(t._wait_for_cooldown(_record('a')))
+        self.assertLess(time.monotonic() - start, 0.1)
+
+if __name__ == '__main__':
+    unittest.main()